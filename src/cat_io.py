@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+#
+# cat_io.py
+#
+# CAT exchanges on the local serial port
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+"""
+Helpers for the server when it talks to the rig itself rather than
+forwarding client data. The caller must own the serial port for the
+duration of the exchange.
+"""
+
+from time import monotonic
+import serial
+
+# Icom CI-V framing
+CIV_PREAMBLE = 0xFE
+CIV_EOM = 0xFD
+CIV_CONTROLLER = 0xE0
+
+#-------------------------------------------------
+# Write a frame and read the response
+def transact(serial_port, frame, length=None, term=None, timeout=0.5):
+    """
+    Write a frame and return the response bytes.
+
+    Arguments
+        serial_port --  open serial port
+        frame       --  bytes to write
+        length      --  read exactly this many bytes
+        term        --  or read up to and including this byte
+        timeout     --  overall response timeout in seconds
+
+    With neither length nor term the response ends when the line is
+    quiet for one serial read timeout. A length of 0 means no response
+    is expected. A short or empty response is returned on timeout.
+    """
+
+    serial_port.reset_input_buffer()
+    try:
+        serial_port.write(frame)
+    except serial.SerialTimeoutException:
+        return b''
+    if length == 0:
+        return b''
+    return read_response(serial_port, length, term, timeout)
+
+#-------------------------------------------------
+# Read a response
+def read_response(serial_port, length=None, term=None, timeout=0.5):
+    """ Read a response, see transact() """
+
+    data = bytearray()
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        b = serial_port.read(1)
+        if b == b'':
+            if length == None and term == None and len(data) > 0:
+                # Quiet line after some data
+                break
+            continue
+        data += b
+        if length != None and len(data) >= length:
+            break
+        if term != None and b[0] == term:
+            break
+    return bytes(data)
+
+#-------------------------------------------------
+# True if a response is what the step asked for
+def complete(resp, length=None, term=None):
+    if length != None:
+        return len(resp) == length
+    if term != None:
+        return len(resp) > 0 and resp[-1] == term
+    return len(resp) > 0
+
+#-------------------------------------------------
+# Run a batch of steps back to back
+def run_batch(serial_port, steps, stop_on_error=False, on_step=None):
+    """
+    Run each step and capture its response.
+
+    Arguments
+        serial_port     --  open serial port
+        steps           --  list of dicts with 'frame' and optionally
+                            'length', 'term' and 'timeout' as transact()
+                            and 'echo' True to skip the echo of the frame
+        stop_on_error   --  stop at the first incomplete response
+        on_step         --  optional callable, called after each step
+
+    Returns a list of dicts, one per step run, with 'data', 'ok' and 'ms'.
+    """
+
+    results = []
+    for step in steps:
+        t = monotonic()
+        length = step.get('length')
+        term = step.get('term')
+        frame = bytes(step['frame'])
+        resp = transact(serial_port, frame, length, term, step.get('timeout', 0.5))
+        if step.get('echo') and resp == frame:
+            resp = read_response(serial_port, length, term, step.get('timeout', 0.5))
+        ok = length == 0 or complete(resp, length, term)
+        results.append({'data': resp, 'ok': ok, 'ms': (monotonic() - t)*1000})
+        if on_step != None:
+            on_step()
+        if stop_on_error and not ok:
+            break
+    return results
+
+#-------------------------------------------------
+# Check steps from a client before they go near the rig
+def check_steps(steps):
+    """
+    Raises ValueError unless steps is a list of step dicts as taken by
+    run_batch(). Returns a copy with each frame as bytes.
+    """
+
+    if not isinstance(steps, (list, tuple)):
+        raise ValueError("Steps must be a list")
+    checked = []
+    for step in steps:
+        if not isinstance(step, dict):
+            raise ValueError("Step must be a dict not %s" % type(step).__name__)
+        # bytes(n) would be n zero bytes so only accept byte sequences
+        frame = step.get('frame')
+        if not isinstance(frame, (bytes, bytearray, list)):
+            raise ValueError("Step frame must be bytes or a list of byte values")
+        for key in ('length', 'term'):
+            if step.get(key) != None and (not isinstance(step[key], int) or step[key] < 0):
+                raise ValueError("Step %s must be an integer >= 0" % key)
+        if not isinstance(step.get('timeout', 0.5), (int, float)) or step.get('timeout', 0.5) < 0:
+            raise ValueError("Step timeout must be a number >= 0")
+        step = dict(step)
+        try:
+            step['frame'] = bytes(frame)
+        except TypeError:
+            raise ValueError("Step frame must be bytes or a list of byte values")
+        checked.append(step)
+    return checked
+
+#-------------------------------------------------
+# Steps from text, one step per line
+def parse_steps(text):
+    """
+    Each line is a frame in hex optionally followed by length=N,
+    term=XX (hex), timeout=S and echo=1, e.g.
+        00 00 00 00 03 length=5
+        FE FE 94 E0 03 FD term=FD echo=1
+    """
+
+    steps = []
+    for line in text.splitlines():
+        line = line.split('#')[0].strip()
+        if len(line) == 0:
+            continue
+        frame = bytearray()
+        step = {}
+        for token in line.split():
+            if '=' in token:
+                key, value = token.split('=', 1)
+                if key == 'length':
+                    step['length'] = int(value)
+                elif key == 'term':
+                    step['term'] = int(value, 16)
+                elif key == 'timeout':
+                    step['timeout'] = float(value)
+                elif key == 'echo':
+                    step['echo'] = value not in ('0', 'false')
+                else:
+                    raise ValueError("Unknown step option '%s'" % key)
+            else:
+                frame += bytes.fromhex(token)
+        step['frame'] = bytes(frame)
+        steps.append(step)
+    return steps
+
+#-------------------------------------------------
+# BCD, two digits per byte, most significant byte first
+def to_bcd(value, nbytes):
+    digits = '%0*d' % (nbytes*2, value)
+    if len(digits) > nbytes*2:
+        raise ValueError("%d does not fit in %d BCD bytes" % (value, nbytes))
+    return bytes.fromhex(digits)
+
+def from_bcd(data):
+    return int(bytes(data).hex())
+
+#-------------------------------------------------
+# Icom CI-V
+def civ_frame(addr, cmd):
+    """ CI-V frame to the rig at addr, cmd is the command and data bytes """
+
+    return bytes([CIV_PREAMBLE, CIV_PREAMBLE, addr, CIV_CONTROLLER]) + bytes(cmd) + bytes([CIV_EOM])
+
+def civ_transact(serial_port, addr, cmd, timeout=0.5):
+    """
+    Send a CI-V command and return the body (command and data bytes)
+    of the reply from the rig, or None on timeout. The echo of our own
+    frame on the single wire bus is skipped.
+    """
+
+    frame = civ_frame(addr, cmd)
+    resp = transact(serial_port, frame, term=CIV_EOM, timeout=timeout)
+    deadline = monotonic() + timeout
+    while True:
+        if len(resp) >= 5 and resp[-1] == CIV_EOM:
+            start = resp.rfind(bytes([CIV_PREAMBLE, CIV_PREAMBLE]))
+            if start >= 0 and len(resp) - start >= 5:
+                f = resp[start:]
+                if f[2] == CIV_CONTROLLER and f[3] == addr:
+                    return f[4:-1]
+        # Echo, noise or partial, try for the next frame
+        if monotonic() >= deadline:
+            return None
+        resp = read_response(serial_port, term=CIV_EOM, timeout=deadline - monotonic())
+        if len(resp) == 0:
+            return None
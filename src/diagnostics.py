@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+#
+# diagnostics.py
+#
+# Event log and sampling profiler for serial server
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+"""
+The hot loops record events into a preallocated ring rather than
+printing, so a burst of errors cannot block them on stdout. A drain
+thread prints new events in the background. The ring can be dumped
+and a sampling profiler run on a live server through the control port.
+"""
+
+import sys
+import threading
+from time import time, monotonic, strftime, localtime
+
+# Event kinds
+ERROR = 'error'
+TIMEOUT = 'timeout'
+STATE = 'state'
+INFO = 'info'
+
+#=====================================================
+# Event ring
+#=====================================================
+class EventRing:
+
+    #-------------------------------------------------
+    # Initialisation
+    def __init__(self, size=1024):
+        """
+        Constructor
+
+        Arguments
+            size    --  number of events kept
+        """
+
+        # Slots are [seq, time, kind, source, message]
+        self.__slots = [[-1, 0.0, '', '', ''] for _ in range(size)]
+        self.__size = size
+        self.__seq = 0
+        self.__lock = threading.Lock()
+
+    #-------------------------------------------------
+    # Add an event, never blocks on I/O
+    def record(self, kind, source, message):
+        with self.__lock:
+            slot = self.__slots[self.__seq % self.__size]
+            slot[0] = self.__seq
+            slot[1] = time()
+            slot[2] = kind
+            slot[3] = source
+            slot[4] = message
+            self.__seq += 1
+
+    #-------------------------------------------------
+    # Sequence number of the next event
+    def next_seq(self):
+        return self.__seq
+
+    #-------------------------------------------------
+    # Events from seq onwards, oldest first
+    def since(self, seq):
+        """
+        Returns (events, next seq, lost) where events are tuples of
+        (seq, time, kind, source, message) and lost is the number of
+        events after seq that were overwritten before being read.
+        """
+
+        with self.__lock:
+            end = self.__seq
+            start = max(seq, end - self.__size, 0)
+            events = [tuple(self.__slots[n % self.__size]) for n in range(start, end)]
+        return events, end, start - seq if seq < start else 0
+
+#-------------------------------------------------
+# One line for an event
+def format_event(event):
+    seq, t, kind, source, message = event
+    ms = int((t - int(t))*1000)
+    return "%s.%03d %-7s %s: %s" % (strftime('%H:%M:%S', localtime(t)), ms, kind, source, message)
+
+#=====================================================
+# Drain thread, prints new events
+#=====================================================
+class EventDrain (threading.Thread):
+
+    #-------------------------------------------------
+    # Initialisation
+    def __init__(self, ring, period=0.5):
+        """
+        Constructor
+
+        Arguments
+            ring    --  EventRing to drain
+            period  --  seconds between drains
+        """
+
+        super(EventDrain, self).__init__(daemon=True)
+
+        self.__ring = ring
+        self.__period = period
+        self.__seq = ring.next_seq()
+        self.__terminate = threading.Event()
+
+    #-------------------------------------------------
+    # Terminate thread after a final drain
+    def terminate(self):
+        """ Terminate thread """
+
+        self.__terminate.set()
+
+    #-------------------------------------------------
+    # Thread entry point
+    def run(self):
+        """ Print events as they arrive """
+
+        while not self.__terminate.wait(self.__period):
+            self.__drain()
+        self.__drain()
+
+    def __drain(self):
+        events, self.__seq, lost = self.__ring.since(self.__seq)
+        if lost > 0:
+            print("... %d events lost ..." % lost)
+        for event in events:
+            print(format_event(event))
+
+#=====================================================
+# Sampling profiler
+#=====================================================
+class SamplingProfiler (threading.Thread):
+
+    #-------------------------------------------------
+    # Initialisation
+    def __init__(self, seconds, interval=0.005, depth=4):
+        """
+        Constructor
+
+        Arguments
+            seconds     --  run time
+            interval    --  seconds between samples
+            depth       --  frames kept for each sampled stack
+        """
+
+        super(SamplingProfiler, self).__init__(daemon=True)
+
+        self.__seconds = seconds
+        self.__interval = interval
+        self.__depth = depth
+        self.__counts = {}
+        self.__samples = 0
+        self.__lock = threading.Lock()
+        self.__terminate = threading.Event()
+
+    #-------------------------------------------------
+    # Stop early
+    def terminate(self):
+        """ Terminate thread """
+
+        self.__terminate.set()
+
+    #-------------------------------------------------
+    # Thread entry point
+    def run(self):
+        """ Sample all other threads until time is up """
+
+        me = threading.get_ident()
+        names = {}
+        end = monotonic() + self.__seconds
+        while monotonic() < end and not self.__terminate.wait(self.__interval):
+            for t in threading.enumerate():
+                names[t.ident] = t.name
+            frames = sys._current_frames()
+            with self.__lock:
+                self.__samples += 1
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame != None and len(stack) < self.__depth:
+                        code = frame.f_code
+                        stack.append("%s:%d %s" % (code.co_filename.split('/')[-1], frame.f_lineno, code.co_name))
+                        frame = frame.f_back
+                    key = (names.get(ident, str(ident)), ' < '.join(stack))
+                    self.__counts[key] = self.__counts.get(key, 0) + 1
+
+    #-------------------------------------------------
+    # Most frequent stacks
+    def report(self, top=20):
+        """
+        Returns a dict with the sample count, whether the profiler is
+        still running and the top stacks as (count, thread, stack).
+        """
+
+        with self.__lock:
+            stacks = sorted([(c, k[0], k[1]) for k, c in self.__counts.items()], reverse=True)[:top]
+            samples = self.__samples
+        return {"samples": samples, "running": self.is_alive(), "stacks": stacks}
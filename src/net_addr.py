@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# net_addr.py
+#
+# Bind address helpers for the serial server and client
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+"""
+Both ends bind their UDP sockets to a configured address. These turn
+the configured value into an address to bind.
+"""
+
+import socket
+import platform
+
+#-------------------------------------------------
+# Address to bind our sockets to
+def resolve_bind(bind):
+
+    if bind in ('', '*', '0.0.0.0'):
+        return '0.0.0.0'
+    elif bind == 'auto':
+        return get_local_ip()
+    return bind
+
+#-------------------------------------------------
+# Get my local ip address
+def get_local_ip():
+
+    try:
+        if platform.system() == 'Windows':
+            return socket.gethostbyname(socket.gethostname())
+        elif platform.system() == 'Linux':
+            ip_address = '';
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # No packet is sent, this just selects the outgoing interface
+            s.connect(("8.8.8.8",80))
+            ip_address = s.getsockname()[0]
+            s.close()
+            return ip_address
+        else:
+            print ("Sorry, platform is %s which is not supported!" % platform.system())
+    except OSError as e:
+        print ("Unable to determine local address [%s]" % str(e))
+    # Fall back to any address
+    print ("Binding to all addresses")
+    return '0.0.0.0'
@@ -24,6 +24,49 @@
 #
 
 import serial
+from time import sleep, monotonic
+
+import cat_io
+
+"""
+Power drivers are selected by rig model. A driver turns the rig on and
+off and answers whether the rig is responding using a cheap status
+query. power_on() probes with backoff until the rig answers so the
+server knows when it can start forwarding client data.
+Further models can be added with register().
+"""
+
+#=====================================================
+# Driver interface
+#=====================================================
+class PowerDriver:
+    
+    #-------------------------------------------------
+    # Initialisation
+    def __init__(self, **options):
+        """
+        Constructor
+        
+        Arguments
+            options --  model specific options from the rig configuration
+        """
+        
+        self._options = options
+    
+    #-------------------------------------------------
+    # Send the power on command(s)
+    def on(self, serial_port):
+        raise NotImplementedError
+    
+    #-------------------------------------------------
+    # Send the power off command(s)
+    def off(self, serial_port):
+        raise NotImplementedError
+    
+    #-------------------------------------------------
+    # True if the rig answers a status query
+    def probe(self, serial_port):
+        raise NotImplementedError
 
 #=====================================================
 # Power Control for FT817
@@ -32,33 +75,105 @@ import serial
 # the power-on command will work. Not terribly useful as it
 # requires the PSU to be left on continuously. Drain is 10mA when
 # in the sleep state.
+#=====================================================
+class FT817Power(PowerDriver):
+    
+    EMPTY_SEQ = bytes([0x00,0x00,0x00,0x00,0x00])
+    ON_SEQ = bytes([0x00,0x00,0x00,0x00,0x0F])
+    OFF_SEQ = bytes([0x00,0x00,0x00,0x00,0x8F])
+    # Read frequency and mode, 5 byte reply
+    STATUS_SEQ = bytes([0x00,0x00,0x00,0x00,0x03])
+    
+    def on(self, serial_port):
+        serial_port.write(self.EMPTY_SEQ)
+        serial_port.write(self.ON_SEQ)
+        
+    def off(self, serial_port):
+        serial_port.write(self.EMPTY_SEQ)
+        serial_port.write(self.OFF_SEQ)
+        
+    def probe(self, serial_port):
+        return len(cat_io.transact(serial_port, self.STATUS_SEQ, length=5, timeout=0.2)) == 5
+
+#=====================================================
+# Power Control for Icom CI-V rigs
+# The rig must be powered and have CI-V power on enabled. The
+# preamble wakes the CI-V interface, its length depends on baud rate.
+#=====================================================
+class IcomPower(PowerDriver):
+    
+    def __addr(self):
+        return self._options.get('civaddr', 0x94)
+    
+    def on(self, serial_port):
+        count = max(7, serial_port.baudrate // 768)
+        serial_port.write(bytes([cat_io.CIV_PREAMBLE]*count) + cat_io.civ_frame(self.__addr(), [0x18, 0x01]))
+        
+    def off(self, serial_port):
+        serial_port.write(cat_io.civ_frame(self.__addr(), [0x18, 0x00]))
+        
+    def probe(self, serial_port):
+        # Read operating frequency
+        resp = cat_io.civ_transact(serial_port, self.__addr(), [0x03], timeout=0.2)
+        return resp != None and len(resp) > 0 and resp[0] == 0x03
+
+#=====================================================
+# Driver registry
+#=====================================================
+DRIVERS = {
+    'ft817': FT817Power,
+    'icom': IcomPower,
+}
+
+#-------------------------------------------------
+# Add a driver for a model
+def register(model, driver_class):
+    DRIVERS[model] = driver_class
+
+#-------------------------------------------------
+# Driver instance for a model
+def get_driver(model, **options):
+    if model not in DRIVERS:
+        raise ValueError("No power driver for rig model '%s'" % model)
+    return DRIVERS[model](**options)
 
 #-------------------------------------------------
 # Power device on
-def power_on(serial_port):
-    
-    empty_seq = bytes([0x00,0x00,0x00,0x00,0x00])
-    on_seq = bytes([0x00,0x00,0x00,0x00,0x0F])
+def power_on(serial_port, model='ft817', timeout=10.0, **options):
+    """
+    Power the rig on and wait until it answers a status query.
+    Returns the wake time in seconds or None if it never answered.
+    """
     
+    driver = get_driver(model, **options)
     print("Powering up rig...")
+    start = monotonic()
     try:
-        serial_port.write(empty_seq)
-        serial_port.write(on_seq)
+        driver.on(serial_port)
     except serial.SerialTimeoutException:
         # I guess we could get a timeout as well
-        printf("Timeout trying to power-up rig!")
+        print("Timeout trying to power-up rig!")
+        return None
+    
+    # Probe with backoff until the rig answers
+    delay = 0.05
+    while monotonic() - start < timeout:
+        if driver.probe(serial_port):
+            wake = monotonic() - start
+            print("Rig responding after %.0fms" % (wake*1000))
+            return wake
+        sleep(delay)
+        delay = min(delay*2, 1.0)
+    print("Rig did not respond within %.1fs of power-up!" % timeout)
+    return None
         
 #-------------------------------------------------
-# Power device on
-def power_off(serial_port):
+# Power device off
+def power_off(serial_port, model='ft817', **options):
     
     print("Powering down rig...")
-    empty_seq = bytes([0x00,0x00,0x00,0x00,0x00])
-    off_seq = bytes([0x00,0x00,0x00,0x00,0x8F])
-    
     try:
-        serial_port.write(empty_seq)
-        serial_port.write(off_seq)
+        get_driver(model, **options).off(serial_port)
     except serial.SerialTimeoutException:
         # I guess we could get a timeout as well
-        printf("Timeout trying to power-down rig!")
\ No newline at end of file
+        print("Timeout trying to power-down rig!")
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+#
+# rig_client.py
+#
+# Python client library for the serial server
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+"""
+Library access to a rig on the serial server without a virtual serial
+port. Configuration handling is shared with serial_client.py.
+
+AsyncRig talks to the server control port. Each request carries a
+sequence id which the server echoes, so any number of requests can be
+in flight and each has its own timeout. For example -
+
+    rig = AsyncRig.from_config('serial_yeasu.conf')
+    await rig.connect()
+    freq = await rig.get_frequency()
+    resp = await rig.send(bytes([0x00,0x00,0x00,0x00,0xE7]), length=1)
+    # Pipelined
+    results = await asyncio.gather(rig.get_frequency(), rig.send(...))
+    async for freq, signal in rig.scan(14000000, 14350000, 1000):
+        ...
+    await rig.profile('start', seconds=30)
+    await rig.close()
+"""
+
+import asyncio
+import pickle
+import platform
+import configparser
+
+import cat_io
+import scan_engine
+import net_addr
+
+#=====================================================
+# Configuration
+#=====================================================
+
+#-------------------------------------------------
+# Read a client configuration file
+def read_config(path):
+    """
+    Returns (net_p, cli_p, svr_p) dictionaries or None on error.
+    """
+
+    config = configparser.ConfigParser()
+    if len(config.read(path)) == 0:
+        print ("Failed to read '%s', please create and try again!" % path)
+        return None
+    return assemble_params(config)
+
+#-------------------------------------------------
+# Assemble parameters into logical structures
+def assemble_params(c):
+
+    # Check we have the required sections
+    if not 'network' in c:
+        print ("Missing 'network' section in configuration!")
+        return None
+    if not 'serialports' in c:
+        print ("Missing 'serialports' section in configuration!")
+        return None
+    if not 'cliparams' in c:
+        print ("Missing 'cliparams' section in configuration!")
+        return None
+    if not 'svrparams' in c:
+        print ("Missing 'svrparams' section in configuration!")
+        return None
+
+    # Assemble parameters into dictionaries
+    net_p = {}
+    cli_p = {}
+    svr_p = {}
+
+    # Ref to the config sections
+    s1 = c['network']
+    s2 = c['serialports']
+    s3 = c['cliparams']
+    s4 = c['svrparams']
+
+    # Collect params into dictionaries
+    try:
+        # Network
+        net_p['serverip'] = s1['serverip']
+        net_p['controlport'] = int(s1['controlport'])
+        net_p['serverport'] = int(s1['serverport'])
+        net_p['localport'] = int(s1['localport'])
+        net_p['localip'] = net_addr.resolve_bind(s1.get('bindip', ''))
+        # Rig model, used by the library for frequency access
+        net_p['model'] = s1.get('model', 'ft817')
+        net_p['civaddr'] = int(s1.get('civaddr', '0x94'), 0)
+        # Serial
+        if platform.system() == 'Windows':
+            cli_p['port'] = s2['winclient']
+        else:
+            cli_p['port'] = s2['linclient']
+        if s2["target"] == 'Windows':
+            svr_p['port'] = s2['winserver']
+        else:
+            svr_p['port'] = s2['linserver']
+        cli_p['baud'] = int(s3['baudrate'])
+        svr_p['baud'] = int(s4['baudrate'])
+        cli_p['databits'] = int(s3['databits'])
+        svr_p['databits'] = int(s4['databits'])
+        cli_p['parity'] = s3['parity']
+        svr_p['parity'] = s4['parity']
+        cli_p['stopbits'] = int(s3['stopbits'])
+        svr_p['stopbits'] = int(s4['stopbits'])
+        cli_p['readtimeout'] = float(s3['readtimeout'])
+        svr_p['readtimeout'] = float(s4['readtimeout'])
+        cli_p['writetimeout'] = float(s3['writetimeout'])
+        svr_p['writetimeout'] = float(s4['writetimeout'])
+        cli_p['xonxoff'] = int(s3['xonxoff'])
+        svr_p['xonxoff'] = int(s4['xonxoff'])
+        cli_p['rtscts'] = int(s3['rtscts'])
+        svr_p['rtscts'] = int(s4['rtscts'])
+    except KeyError as k:
+        print ("Missing: %s from configuration!" % k)
+        return None
+    except ValueError as e:
+        print ("Invalid value in configuration! [%s]" % str(e))
+        return None
+    return net_p, cli_p, svr_p
+
+#-------------------------------------------------
+# Connect request for the server
+def connect_request(net_p, svr_p):
+    return {"rqst": "connect", "data": {'net': [net_p['serverport'], net_p['localport']], 'serial': svr_p}}
+
+#=====================================================
+# Errors
+#=====================================================
+class RigError(Exception):
+    """ The server rejected a request """
+
+#=====================================================
+# Control port protocol
+#=====================================================
+class _ControlProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, rig):
+        self.__rig = rig
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = pickle.loads(data)
+        except Exception:
+            return
+        # Stray datagrams are dropped
+        if not isinstance(msg, dict):
+            return
+        self.__rig._dispatch(msg)
+
+    def error_received(self, exc):
+        # Typically the server is not running, requests will time out
+        pass
+
+class _DataProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, on_data):
+        self.__on_data = on_data
+
+    def datagram_received(self, data, addr):
+        if self.__on_data != None:
+            self.__on_data(data)
+
+#=====================================================
+# Async rig
+#=====================================================
+class AsyncRig:
+
+    #-------------------------------------------------
+    # Initialisation
+    def __init__(self, net_p, svr_p, timeout=2.0, on_data=None):
+        """
+        Constructor
+
+        Arguments
+            net_p   --  network parameters as read_config()
+            svr_p   --  server serial parameters as read_config()
+            timeout --  default per request timeout in seconds
+            on_data --  optional callable for data from the rig which
+                        is not a response to a request
+        """
+
+        self.__net_p = net_p
+        self.__svr_p = svr_p
+        self.__timeout = timeout
+        self.__on_data = on_data
+        self.__model = net_p.get('model', 'ft817')
+        self.__civaddr = net_p.get('civaddr', 0x94)
+
+        self.__seq = 0
+        self.__pending = {}
+        self.__scans = {}
+        self.__control = None
+        self.__data = None
+        self.__ready = None
+
+    #-------------------------------------------------
+    # Construct from a client configuration file
+    @classmethod
+    def from_config(cls, path, **kwargs):
+        params = read_config(path)
+        if params == None:
+            raise RigError("Failed to read configuration '%s'" % path)
+        net_p, _, svr_p = params
+        return cls(net_p, svr_p, **kwargs)
+
+    #-------------------------------------------------
+    # Connect to the server
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        self.__ready = asyncio.Event()
+        self.__control, _ = await loop.create_datagram_endpoint(
+            lambda: _ControlProtocol(self),
+            remote_addr=(self.__net_p['serverip'], self.__net_p['controlport']))
+        self.__data, _ = await loop.create_datagram_endpoint(
+            lambda: _DataProtocol(self.__on_data),
+            local_addr=(self.__net_p['localip'], self.__net_p['localport']))
+        self.__control.sendto(pickle.dumps(connect_request(self.__net_p, self.__svr_p)))
+
+    #-------------------------------------------------
+    # Wait for the server to report the rig is responding
+    async def wait_ready(self, timeout=None):
+        await asyncio.wait_for(self.__ready.wait(), timeout)
+
+    #-------------------------------------------------
+    # Disconnect from the server
+    async def close(self):
+        if self.__control == None:
+            return
+        self.__control.sendto(pickle.dumps({"rqst": "disconnect", "data": []}))
+        for f in self.__pending.values():
+            if not f.done():
+                f.cancel()
+        self.__pending.clear()
+        self.__control.close()
+        self.__data.close()
+        self.__control = None
+        self.__data = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    #-------------------------------------------------
+    # Send a control request and wait for its reply data
+    async def request(self, rqst, data=None, timeout=None):
+        """
+        Requests are matched to replies by sequence id so several may
+        be in flight at once. Raises RigError if the server rejects the
+        request and asyncio.TimeoutError if there is no reply in time.
+        """
+
+        seq = self.__next_seq()
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[seq] = future
+        try:
+            self.__control.sendto(pickle.dumps({"rqst": rqst, "seq": seq, "data": data}))
+            return await asyncio.wait_for(future, timeout if timeout != None else self.__timeout)
+        finally:
+            self.__pending.pop(seq, None)
+
+    #-------------------------------------------------
+    # CAT frames
+    async def send(self, frame, length=None, term=None, echo=False, timeout=None):
+        """
+        Send one CAT frame and return the response bytes. Response
+        framing is as cat_io.transact(), length=0 expects no response.
+        """
+
+        result = await self.batch([self.__step(frame, length, term, echo)], timeout=timeout)
+        return result[0]['data']
+
+    async def batch(self, steps, stop_on_error=False, timeout=None):
+        """ Run steps back to back on the server, returns the step results """
+
+        reply = await self.request("batch", {"steps": steps, "stoponerror": stop_on_error}, timeout)
+        return reply["results"]
+
+    async def store(self, name, steps, timeout=None):
+        """ Store a macro on the server for this session """
+
+        return await self.request("store", {"id": name, "steps": steps}, timeout)
+
+    async def macro(self, name, stop_on_error=False, timeout=None):
+        """ Run a stored macro, returns the step results """
+
+        reply = await self.request("macro", {"id": name, "stoponerror": stop_on_error}, timeout)
+        return reply["results"]
+
+    #-------------------------------------------------
+    # Frequency in Hz
+    async def get_frequency(self, timeout=None):
+        if self.__model == 'icom':
+            resp = await self.send(cat_io.civ_frame(self.__civaddr, [0x03]), term=cat_io.CIV_EOM, echo=True, timeout=timeout)
+            # FE FE E0 addr 03 <5 BCD bytes, least significant first> FD
+            if len(resp) != 11 or resp[4] != 0x03:
+                raise RigError("Bad frequency response %s" % resp.hex())
+            return cat_io.from_bcd(resp[5:10][::-1])
+        resp = await self.send(bytes([0x00,0x00,0x00,0x00,0x03]), length=5, timeout=timeout)
+        if len(resp) != 5:
+            raise RigError("Bad frequency response %s" % resp.hex())
+        # 8 BCD digits in 10Hz units then the mode
+        return cat_io.from_bcd(resp[0:4])*10
+
+    async def set_frequency(self, freq, timeout=None):
+        if self.__model == 'icom':
+            resp = await self.send(cat_io.civ_frame(self.__civaddr, bytes([0x05]) + cat_io.to_bcd(freq, 5)[::-1]), term=cat_io.CIV_EOM, echo=True, timeout=timeout)
+            if len(resp) != 6 or resp[4] != 0xFB:
+                raise RigError("Set frequency rejected %s" % resp.hex())
+            return
+        await self.send(cat_io.to_bcd(freq // 10, 4) + bytes([0x01]), length=0, timeout=timeout)
+
+    #-------------------------------------------------
+    # Server side scan
+    async def scan(self, start, stop, step, dwell=0.0, threshold=0, squelch=False):
+        """
+        Async generator of (frequency, signal) for steps that pass the
+        threshold or open the squelch. Raises RigError if the scan is
+        rejected or fails on the server and asyncio.TimeoutError if the
+        server goes quiet for longer than the timeout plus the dwell.
+
+        A scan left early is stopped on the server when the generator
+        is closed. Use contextlib.aclosing() to close it as soon as the
+        loop is left rather than when it is garbage collected -
+
+            async with aclosing(rig.scan(14000000, 14350000, 1000)) as scan:
+                async for freq, signal in scan:
+                    if signal > 5:
+                        break
+        """
+
+        seq = self.__next_seq()
+        queue = asyncio.Queue()
+        self.__scans[seq] = queue
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[seq] = future
+        started = done = False
+        try:
+            self.__control.sendto(pickle.dumps({"rqst": "scan", "seq": seq, "data": {
+                "start": start, "stop": stop, "step": step, "dwell": dwell,
+                "threshold": threshold, "squelch": squelch}}))
+            await asyncio.wait_for(future, self.__timeout)
+            started = True
+            while not done:
+                # The server sends a block at least every step while scanning
+                d = await asyncio.wait_for(queue.get(), self.__timeout + dwell)
+                done = d["done"]
+                for record in scan_engine.unpack_records(d["records"]):
+                    yield record
+                if "error" in d:
+                    raise RigError("Scan failed [%s]" % d["error"])
+        finally:
+            self.__pending.pop(seq, None)
+            self.__scans.pop(seq, None)
+            # Only stop a scan we started, it may be another caller's
+            if started and not done and self.__control != None:
+                await self.request("scanstop")
+
+    #-------------------------------------------------
+    # Diagnostics
+    async def events(self, since=0, count=100, timeout=None):
+        """
+        Server events from seq since, oldest first. Returns a dict of
+        events, next to pass as since for the next page and lost, the
+        number of events overwritten before they were read.
+        """
+
+        return await self.request("events", {"since": since, "count": count}, timeout)
+
+    async def profile(self, action, seconds=10, interval=0.005, top=20, timeout=None):
+        """
+        Sampling profiler on the server, action is start, stop or report.
+        stop and report return the top stacks.
+        """
+
+        return await self.request("profile", {"action": action, "seconds": seconds, "interval": interval, "top": top}, timeout)
+
+    #-------------------------------------------------
+    # Replies from the server
+    def _dispatch(self, msg):
+        if msg.get("rqst") == "ready":
+            self.__ready.set()
+            return
+        seq = msg.get("seq")
+        if not isinstance(seq, int):
+            return
+        if msg.get("resp") == "scandata":
+            if seq in self.__scans and isinstance(msg.get("data"), dict):
+                self.__scans[seq].put_nowait(msg["data"])
+            return
+        future = self.__pending.get(seq)
+        if future == None or future.done():
+            # Late reply to a request that timed out
+            return
+        if "error" in msg:
+            future.set_exception(RigError(msg["error"]))
+        else:
+            future.set_result(msg.get("data"))
+
+    #-------------------------------------------------
+    # Helpers
+    def __next_seq(self):
+        self.__seq += 1
+        return self.__seq
+
+    def __step(self, frame, length, term, echo):
+        step = {"frame": bytes(frame)}
+        if length != None:
+            step["length"] = length
+        if term != None:
+            step["term"] = term
+        if echo:
+            step["echo"] = True
+        return step
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#
+# rig_stats.py
+#
+# Shared memory statistics for serial server workers
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+"""
+Statistics block shared between the supervisor and the rig workers.
+The block holds one fixed size slot per rig. Each field in a slot has
+exactly one writer so no locking is required. The supervisor reads
+the slots directly, there is no IPC round trip.
+"""
+
+import struct
+from time import time
+from multiprocessing import shared_memory
+
+#=====================================================
+# Slot layout
+# Field name and struct format, in order
+FIELDS = (
+    ('pid', 'q'),           # Worker process id
+    ('state', 'q'),         # One of the STATE_ values
+    ('heartbeat', 'd'),     # Time of last worker heartbeat
+    ('to_net', 'Q'),        # Bytes serial -> network
+    ('to_serial', 'Q'),     # Bytes network -> serial
+    ('reader_errors', 'Q'), # Errors in the reader thread
+    ('writer_errors', 'Q'), # Errors in the writer thread
+    ('startup_ms', 'd'),    # Start to first rig response
+    ('restarts', 'Q'),      # Restarts, written by the supervisor
+)
+SLOT_FMT = '<' + ''.join([f for _, f in FIELDS])
+SLOT_SIZE = struct.calcsize(SLOT_FMT)
+# Offset and format for each field
+OFFSETS = {}
+for _i, (_name, _fmt) in enumerate(FIELDS):
+    OFFSETS[_name] = (struct.calcsize(SLOT_FMT[:_i+1]), '<' + _fmt)
+del _i, _name, _fmt
+
+# Worker states
+STATE_STOPPED = 0
+STATE_STARTING = 1
+STATE_WAITING = 2
+STATE_RUNNING = 3
+STATE_NAMES = {
+    STATE_STOPPED: 'stopped',
+    STATE_STARTING: 'starting',
+    STATE_WAITING: 'waiting',
+    STATE_RUNNING: 'running',
+}
+
+#=====================================================
+# The shared block
+#=====================================================
+class StatsBlock:
+
+    #-------------------------------------------------
+    # Initialisation
+    def __init__(self, slots, name=None):
+        """
+        Constructor
+
+        Arguments
+            slots   --  number of rig slots
+            name    --  attach to this existing block, else create a new block
+        """
+
+        self.__owner = name is None
+        if self.__owner:
+            self.__shm = shared_memory.SharedMemory(create=True, size=slots*SLOT_SIZE)
+            self.__shm.buf[:slots*SLOT_SIZE] = bytes(slots*SLOT_SIZE)
+        else:
+            self.__shm = shared_memory.SharedMemory(name=name)
+        self.__slots = slots
+
+    #-------------------------------------------------
+    # Block name to pass to workers
+    def name(self):
+        return self.__shm.name
+
+    #-------------------------------------------------
+    # Stats for one slot
+    def slot(self, n):
+        if n < 0 or n >= self.__slots:
+            raise IndexError('Stats slot %d out of range' % n)
+        return RigStats(self.__shm.buf, n)
+
+    #-------------------------------------------------
+    # Release, the owner also removes the block
+    def close(self):
+        self.__shm.close()
+        if self.__owner:
+            self.__shm.unlink()
+
+#=====================================================
+# Accessor for one slot
+#=====================================================
+class RigStats:
+
+    #-------------------------------------------------
+    # Initialisation
+    def __init__(self, buf, slot):
+        """
+        Constructor
+
+        Arguments
+            buf     --  shared memory buffer
+            slot    --  slot index
+        """
+
+        self.__buf = buf
+        self.__base = slot*SLOT_SIZE
+
+    #-------------------------------------------------
+    # Field access
+    def get(self, field):
+        offset, fmt = OFFSETS[field]
+        return struct.unpack_from(fmt, self.__buf, self.__base + offset)[0]
+
+    def set(self, field, value):
+        offset, fmt = OFFSETS[field]
+        struct.pack_into(fmt, self.__buf, self.__base + offset, value)
+
+    def incr(self, field, n=1):
+        # Only safe when this process is the sole writer of the field
+        self.set(field, self.get(field) + n)
+
+    def beat(self):
+        self.set('heartbeat', time())
+
+    #-------------------------------------------------
+    # Consistent enough copy of the whole slot
+    def snapshot(self):
+        values = struct.unpack_from(SLOT_FMT, self.__buf, self.__base)
+        return dict(zip([n for n, _ in FIELDS], values))
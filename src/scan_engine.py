@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+#
+# scan_engine.py
+#
+# Server resident frequency scan for serial server
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+"""
+The scan runs on the server and drives the rig at serial speed.
+Each step sets the frequency, waits for the dwell time and reads the
+signal level. Steps at or above the threshold, or with the squelch
+open, are streamed back to the client as compact records.
+"""
+
+import struct
+import threading
+from time import monotonic
+import serial
+
+import cat_io
+import diagnostics
+
+# One record per reported step, frequency in Hz and raw signal level
+RECORD = struct.Struct('<IB')
+# Records are sent when this many are waiting or FLUSH_TIME has passed
+FLUSH_RECORDS = 64
+FLUSH_TIME = 0.2
+# Limit on steps in one scan
+MAX_STEPS = 1000000
+
+#-------------------------------------------------
+# Unpack a records block into a list of (frequency, signal)
+def unpack_records(data):
+    return [r for r in RECORD.iter_unpack(data)]
+
+#=====================================================
+# Rig operations used by the scan
+#=====================================================
+class ScanDriver:
+
+    #-------------------------------------------------
+    # Initialisation
+    def __init__(self, **options):
+        """
+        Constructor
+
+        Arguments
+            options --  model specific options from the rig configuration
+        """
+
+        self._options = options
+
+    #-------------------------------------------------
+    # Set the frequency in Hz
+    def set_freq(self, serial_port, freq):
+        raise NotImplementedError
+
+    #-------------------------------------------------
+    # Return (signal, squelch open), either may be None if not read
+    def read(self, serial_port, squelch):
+        raise NotImplementedError
+
+#=====================================================
+# FT817
+#=====================================================
+class FT817Scan(ScanDriver):
+
+    def set_freq(self, serial_port, freq):
+        # 8 BCD digits in 10Hz units, no response
+        cat_io.transact(serial_port, cat_io.to_bcd(freq // 10, 4) + bytes([0x01]), length=0)
+
+    def read(self, serial_port, squelch):
+        # Read RX status, S-meter in the low nibble, bit 7 set when squelched
+        resp = cat_io.transact(serial_port, bytes([0x00,0x00,0x00,0x00,0xE7]), length=1, timeout=0.2)
+        if len(resp) != 1:
+            return None, None
+        return resp[0] & 0x0F, (resp[0] & 0x80) == 0
+
+#=====================================================
+# Icom CI-V
+#=====================================================
+class IcomScan(ScanDriver):
+
+    def __addr(self):
+        return self._options.get('civaddr', 0x94)
+
+    def set_freq(self, serial_port, freq):
+        # 10 BCD digits in Hz, least significant byte first
+        cat_io.civ_transact(serial_port, self.__addr(), bytes([0x05]) + cat_io.to_bcd(freq, 5)[::-1], timeout=0.2)
+
+    def read(self, serial_port, squelch):
+        signal = None
+        resp = cat_io.civ_transact(serial_port, self.__addr(), [0x15, 0x02], timeout=0.2)
+        if resp != None and len(resp) == 4 and resp[0] == 0x15:
+            signal = cat_io.from_bcd(resp[2:4])
+        sq = None
+        if squelch:
+            resp = cat_io.civ_transact(serial_port, self.__addr(), [0x15, 0x01], timeout=0.2)
+            if resp != None and len(resp) == 3 and resp[0] == 0x15:
+                sq = resp[2] == 0x01
+        return signal, sq
+
+#=====================================================
+# Driver registry
+#=====================================================
+DRIVERS = {
+    'ft817': FT817Scan,
+    'icom': IcomScan,
+}
+
+#-------------------------------------------------
+# Add a driver for a model
+def register(model, driver_class):
+    DRIVERS[model] = driver_class
+
+#-------------------------------------------------
+# Driver instance for a model
+def get_driver(model, **options):
+    if model not in DRIVERS:
+        raise ValueError("No scan driver for rig model '%s'" % model)
+    return DRIVERS[model](**options)
+
+#=====================================================
+# Scan thread
+#=====================================================
+class ScanThrd (threading.Thread):
+
+    #-------------------------------------------------
+    # Initialisation
+    def __init__(self, serial_port, guard, driver, params, send, events=None):
+        """
+        Constructor
+
+        Arguments
+            serial_port --  open serial port
+            guard       --  PortGuard, held exclusively for the scan
+            driver      --  ScanDriver for the rig
+            params      --  dict of start, stop, step (Hz), dwell (s),
+                            threshold (raw signal) and squelch (bool)
+            send        --  callable(records, done, steps, error) to stream
+                            results, error is None unless the scan failed
+            events      --  optional EventRing for errors
+        """
+
+        super(ScanThrd, self).__init__()
+
+        self.__ser_port = serial_port
+        self.__guard = guard
+        self.__driver = driver
+        self.__send = send
+        self.__events = events if events != None else diagnostics.EventRing()
+
+        self.__start = int(params['start'])
+        self.__stop = int(params['stop'])
+        self.__step = int(params['step'])
+        self.__dwell = float(params.get('dwell', 0.0))
+        self.__threshold = int(params.get('threshold', 0))
+        self.__squelch = bool(params.get('squelch', False))
+        if self.__step <= 0 or self.__stop < self.__start or self.__start < 0:
+            raise ValueError("Invalid scan range %d-%d step %d" % (self.__start, self.__stop, self.__step))
+        if (self.__stop - self.__start) // self.__step + 1 > MAX_STEPS:
+            raise ValueError("Scan exceeds %d steps" % MAX_STEPS)
+
+        self.__terminate = threading.Event()
+
+    #-------------------------------------------------
+    # Terminate thread, takes effect within one step
+    def terminate(self):
+        """ Terminate thread """
+
+        self.__terminate.set()
+
+    #-------------------------------------------------
+    # Thread entry point
+    def run(self):
+        """ Step through the range """
+
+        records = bytearray()
+        last_flush = monotonic()
+        steps = 0
+        freq = self.__start
+        error = None
+        # Client data is held off until the scan ends
+        try:
+            with self.__guard.exclusive():
+                while freq <= self.__stop and not self.__terminate.is_set():
+                    self.__driver.set_freq(self.__ser_port, freq)
+                    # Dwell, a stop request cuts it short
+                    if self.__terminate.wait(self.__dwell):
+                        break
+                    signal, sq = self.__driver.read(self.__ser_port, self.__squelch)
+                    steps += 1
+                    if signal != None and (sq if self.__squelch else signal >= self.__threshold):
+                        records += RECORD.pack(freq, min(signal, 255))
+                    # Stream what we have, an empty block tells the client
+                    # the scan is still running
+                    if len(records) >= FLUSH_RECORDS*RECORD.size or monotonic() - last_flush >= FLUSH_TIME:
+                        self.__send(bytes(records), False, steps, None)
+                        records = bytearray()
+                        last_flush = monotonic()
+                    freq += self.__step
+        except (serial.SerialException, ValueError) as e:
+            # Port failure or a frequency the rig cannot take
+            error = str(e)
+            self.__events.record(diagnostics.ERROR, 'scan', "Scan failed at %d [%s]" % (freq, error))
+        finally:
+            # Always finish with a done block
+            self.__send(bytes(records), True, steps, error)
@@ -41,7 +41,9 @@ import threading
 import queue
 import pickle
 import configparser
-import platform
+
+import rig_client
+import diagnostics
 
 """
 The client consists of two threads:
@@ -56,17 +58,18 @@ class ReaderThrd (threading.Thread):
     
     #-------------------------------------------------
     # Initialisation
-    def __init__(self, server_ip, server_port, serial_port):
+    def __init__(self, server_ip, server_port, serial_port, events=None):
         """
         Constructor
         
         Arguments
-            
+            events  --  optional EventRing for errors
         """
 
         super(ReaderThrd, self).__init__()
         
         self.__ser_port = serial_port
+        self.__events = events if events != None else diagnostics.EventRing()
         
         self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.__addr = (server_ip, server_port)
@@ -113,7 +116,7 @@ class ReaderThrd (threading.Thread):
             #print("Got: ", data)
             self.__sock.sendto(data, self.__addr)
         except socket.timeout:
-            print ("Error sending UDP data!")
+            self.__events.record(diagnostics.TIMEOUT, 'reader', "Error sending UDP data!")
             return
 
 #=====================================================
@@ -123,17 +126,18 @@ class WriterThrd (threading.Thread):
     
     #-------------------------------------------------
     # Initialisation
-    def __init__(self, local_ip, local_port, serial_port):
+    def __init__(self, local_ip, local_port, serial_port, events=None):
         """
         Constructor
         
         Arguments
-            
+            events  --  optional EventRing for errors
         """
 
         super(WriterThrd, self).__init__()
         
         self.__ser_port = serial_port
+        self.__events = events if events != None else diagnostics.EventRing()
         
         self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.__addr = (local_ip, local_port)
@@ -173,7 +177,7 @@ class WriterThrd (threading.Thread):
             # No response is not an error
             return
         except socket.error as err:
-            print("Socket error: {0}".format(err))
+            self.__events.record(diagnostics.ERROR, 'writer', "Socket error: {0}".format(err))
             # Probably not connected
             return
 
@@ -217,8 +221,10 @@ class SerialClient:
             print ("Failed to read 'serial.conf', please create and try again!")
             return 0
         # Assemble params into logical structures
-        if not self.__assemble_params(config):
+        params = rig_client.assemble_params(config)
+        if params == None:
             return 0
+        self.__net_p, self.__cli_p, self.__svr_p = params
         
         # Create local control socket
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -228,7 +234,7 @@ class SerialClient:
         # Send initialisation data to server
         try:
             # Send connect data to the remote device
-            sock.sendto(pickle.dumps({"rqst": "connect", "data": {'net': [self.__net_p['serverport'], self.__net_p['localport']], 'serial': self.__svr_p}}), addr)
+            sock.sendto(pickle.dumps(rig_client.connect_request(self.__net_p, self.__svr_p)), addr)
         except socket.timeout:
             print ("Error sending connect request!")
             return 0
@@ -238,16 +244,29 @@ class SerialClient:
             print("Serial Client - Failed to connect to serial port!")
             return 0
         
+        # Thread errors are printed in the background
+        events = diagnostics.EventRing()
+        drain = diagnostics.EventDrain(events)
+        drain.start()
+        
         # Start the threads
-        reader_thread = ReaderThrd(self.__net_p['serverip'], self.__net_p['serverport'], self.__ser)
+        reader_thread = ReaderThrd(self.__net_p['serverip'], self.__net_p['serverport'], self.__ser, events)
         reader_thread.start()
-        writer_thread = WriterThrd(self.__net_p['localip'], self.__net_p['localport'], self.__ser)
+        writer_thread = WriterThrd(self.__net_p['localip'], self.__net_p['localport'], self.__ser, events)
         writer_thread.start()
         
         print ("Serial Client running...")
-        # Wait for exit
+        # Wait for exit, reporting any notifications from the server
         while True:
             try:
+                data, _ = sock.recvfrom(512)
+                data = self.__decode(data)
+                if data != None:
+                    self.__notification(data)
+            except socket.timeout:
+                continue
+            except socket.error:
+                # Server not up yet, the connect request came back port unreachable
                 sleep(1)
             except KeyboardInterrupt:
                 break
@@ -264,76 +283,32 @@ class SerialClient:
         reader_thread.join()
         writer_thread.terminate()
         writer_thread.join()
+        drain.terminate()
+        drain.join()
         
         print("Serial Client exiting...")
         return 0
 
     #-------------------------------------------------
-    # Connect to serial port    
-    def __assemble_params(self, c):
-        
-        # Check we have the required sections
-        if not 'network' in c:
-            print ("Missing 'network' section in configuration!")
-            return False
-        if not 'serialports' in c:
-            print ("Missing 'serialports' section in configuration!")
-            return False
-        if not 'cliparams' in c:
-            print ("Missing 'cliparams' section in configuration!")
-            return False
-        if not 'svrparams' in c:
-            print ("Missing 'svrparams' section in configuration!")
-            return False
-        
-        # Assemble parameters into dictionaries
-        self.__net_p = {}
-        self.__cli_p = {}
-        self.__svr_p = {}
-        
-        # Ref to the config sections
-        s1 = c['network']
-        s2 = c['serialports']
-        s3 = c['cliparams']
-        s4 = c['svrparams']
-        
-        # Collect params into dictionaries
+    # Unpickle a notification, None if it is not a notification dict
+    def __decode(self, data):
         try:
-            # Network
-            self.__net_p['serverip'] = s1['serverip']
-            self.__net_p['controlport'] = int(s1['controlport'])
-            self.__net_p['serverport'] = int(s1['serverport'])                                            
-            self.__net_p['localport'] = int(s1['localport'])
-            self.__net_p['localip'] = self.__get_local_ip()
-            # Serial
-            if platform.system() == 'Windows':
-                self.__cli_p['port'] = s2['winclient']
-            else:
-                self.__cli_p['port'] = s2['linclient']
-            if s2["target"] == 'Windows':
-                self.__svr_p['port'] = s2['winserver']
-            else:
-                self.__svr_p['port'] = s2['linserver']
-            self.__cli_p['baud'] = int(s3['baudrate'])
-            self.__svr_p['baud'] = int(s4['baudrate'])
-            self.__cli_p['databits'] = int(s3['databits'])
-            self.__svr_p['databits'] = int(s4['databits'])
-            self.__cli_p['parity'] = s3['parity']
-            self.__svr_p['parity'] = s4['parity']
-            self.__cli_p['stopbits'] = int(s3['stopbits'])
-            self.__svr_p['stopbits'] = int(s4['stopbits'])
-            self.__cli_p['readtimeout'] = float(s3['readtimeout'])
-            self.__svr_p['readtimeout'] = float(s4['readtimeout'])
-            self.__cli_p['writetimeout'] = float(s3['writetimeout'])
-            self.__svr_p['writetimeout'] = float(s4['writetimeout'])
-            self.__cli_p['xonxoff'] = int(s3['xonxoff'])
-            self.__svr_p['xonxoff'] = int(s4['xonxoff'])
-            self.__cli_p['rtscts'] = int(s3['rtscts'])
-            self.__svr_p['rtscts'] = int(s4['rtscts'])
-        except KeyError as k:
-            print ("Missing: %s from configuration!" % k)
-            return False
-        return True
+            data = pickle.loads(data)
+        except Exception as e:
+            print("Serial Client - bad notification! [%s]" % str(e))
+            return None
+        if not isinstance(data, dict):
+            print("Serial Client - bad notification! [not a dict]")
+            return None
+        return data
+    
+    #-------------------------------------------------
+    # Notification from the server
+    def __notification(self, data):
+        if data.get("rqst") == "ready":
+            d = data["data"]
+            print("Serial Client - rig ready, first CAT response %.0fms after server start (port open %.0fms, rig ready %.0fms)" % (
+                d["startup"]*1000, d["open"]*1000, d["ready"]*1000))
 
     #-------------------------------------------------
     # Connect to serial port    
@@ -354,23 +329,6 @@ class SerialClient:
             return False
         return True    
     
-    #-------------------------------------------------
-    # Get my local ip address   
-    def __get_local_ip(self):
-        
-        if platform.system() == 'Windows':
-            return socket.gethostbyname(socket.gethostname())
-        elif platform.system() == 'Linux':
-            ip_address = '';
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8",80))
-            ip_address = s.getsockname()[0]
-            s.close()
-            return ip_address
-        else:
-            print ("Sorry, platform is %s which is not supported!" % platform.system())
-            return ''
-        
 #=====================================================
 # Entry point
 #=====================================================
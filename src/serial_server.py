@@ -29,6 +29,7 @@ Its purpose is to -
     Initialise the remote system.
     Read data from the serial device and send to the client device over UDP.
     Read responsers from the client device and write to the serial device.
+In supervisor mode one worker process is run per configured rig.
 """
 
 import os, sys
@@ -41,13 +42,85 @@ import threading
 import queue
 import pickle
 import platform
+import configparser
+import multiprocessing
+from time import time, monotonic
+from contextlib import contextmanager
+
+import rig_stats
+import cat_io
+import scan_engine
+import diagnostics
+import net_addr
+
+# Control requests may carry batches so allow for more than a connect
+CONTROL_BUFFER = 8192
+# Replies must fit a UDP datagram with room for the reply wrapper
+MAX_DATAGRAM = 60000
 
 """
 The server consists of two threads:
     The reader and writer threads.
         and a control class responsible for startup/shutdown.
+The supervisor starts one server per rig in its own process and
+monitors them through a shared memory statistics block.
 """
 
+#=====================================================
+# Serial port ownership
+#===================================================== 
+class PortGuard:
+    """
+    The reader and writer threads are independent, each holds its own
+    lock for a single read or write so a write never waits for a read
+    timeout. Exclusive users such as batches take priority and hold
+    both for the whole exchange so responses are not stolen by the
+    reader. An in flight read delays them by at most one read timeout.
+    """
+    
+    #-------------------------------------------------
+    # Initialisation
+    def __init__(self):
+        
+        self.__read_lock = threading.Lock()
+        self.__write_lock = threading.Lock()
+        self.__mutex = threading.Lock()
+        self.__waiting = 0
+        # Set when no exclusive user is waiting or active
+        self.__clear = threading.Event()
+        self.__clear.set()
+    
+    #-------------------------------------------------
+    # Hold for a single forwarding read or write
+    # Both hold off while an exclusive user is waiting
+    @contextmanager
+    def reading(self):
+        self.__clear.wait()
+        with self.__read_lock:
+            yield
+    
+    @contextmanager
+    def writing(self):
+        self.__clear.wait()
+        with self.__write_lock:
+            yield
+    
+    #-------------------------------------------------
+    # Hold for an exchange
+    @contextmanager
+    def exclusive(self):
+        with self.__mutex:
+            self.__waiting += 1
+            self.__clear.clear()
+        try:
+            with self.__read_lock, self.__write_lock:
+                yield
+        finally:
+            with self.__mutex:
+                self.__waiting -= 1
+                if self.__waiting == 0:
+                    self.__clear.set()
+
 #=====================================================
 # Reader thread
 #===================================================== 
@@ -55,17 +128,29 @@ class ReaderThrd (threading.Thread):
     
     #-------------------------------------------------
     # Initialisation
-    def __init__(self, client_ip, client_port, serial_port):
+    def __init__(self, client_ip, client_port, serial_port, stats=None, on_first=None, ready=None, guard=None, events=None):
         """
         Constructor
         
         Arguments
-            
+            client_ip   --  client address
+            client_port --  client data port
+            serial_port --  open serial port
+            stats       --  optional RigStats for this rig
+            on_first    --  optional callable, called on the first data from the rig
+            ready       --  optional Event, set when the rig is ready
+            guard       --  optional PortGuard shared with exclusive users
+            events      --  optional EventRing for errors
         """
 
         super(ReaderThrd, self).__init__()
         
         self.__ser_port = serial_port
+        self.__stats = stats
+        self.__on_first = on_first
+        self.__ready = ready
+        self.__guard = guard if guard != None else PortGuard()
+        self.__events = events if events != None else diagnostics.EventRing()
         
         self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.__addr = (client_ip, client_port)
@@ -85,6 +170,12 @@ class ReaderThrd (threading.Thread):
     def run(self):
         """ Listen for events """
 
+        # Hold off until the rig is ready
+        # Client data waits in the socket buffer meanwhile
+        while self.__ready != None and not self.__ready.wait(1):
+            if self.__terminate:
+                break
+        
         # Processing loop
         while not self.__terminate:
             self.__process()
@@ -99,7 +190,8 @@ class ReaderThrd (threading.Thread):
         
         # Read 1 byte
         try:
-            data = self.__ser_port.read(1)
+            with self.__guard.reading():
+                data = self.__ser_port.read(1)
             if data == b'':
                 # Timeout seems to return an empty bytes object
                 return
@@ -109,15 +201,22 @@ class ReaderThrd (threading.Thread):
         except serial.SerialException as e:
             # Force termination
             self.__terminate = True
-            print ('Exception [%s][%s]' % (str(e), traceback.format_exc()))
+            self.__events.record(diagnostics.ERROR, 'reader', 'Exception [%s][%s]' % (str(e), traceback.format_exc()))
+            if self.__stats != None: self.__stats.incr('reader_errors')
             return
         
         # Dispatch to server
         try:
             self.__sock.sendto(data, self.__addr)
         except socket.timeout:
-            print ("Error sending UDP data!")
+            self.__events.record(diagnostics.TIMEOUT, 'reader', "Error sending UDP data!")
+            if self.__stats != None: self.__stats.incr('reader_errors')
             return
+        if self.__stats != None: self.__stats.incr('to_net', len(data))
+        if self.__on_first != None:
+            on_first = self.__on_first
+            self.__on_first = None
+            on_first()
 
 #=====================================================
 # Writer thread
@@ -126,17 +225,27 @@ class WriterThrd (threading.Thread):
     
     #-------------------------------------------------
     # Initialisation
-    def __init__(self, local_ip, local_port, serial_port):
+    def __init__(self, local_ip, local_port, serial_port, stats=None, ready=None, guard=None, events=None):
         """
         Constructor
         
         Arguments
-            
+            local_ip    --  address to bind
+            local_port  --  data port to bind
+            serial_port --  open serial port
+            stats       --  optional RigStats for this rig
+            ready       --  optional Event, set when the rig is ready
+            guard       --  optional PortGuard shared with exclusive users
+            events      --  optional EventRing for errors
         """
 
         super(WriterThrd, self).__init__()
         
         self.__ser_port = serial_port
+        self.__stats = stats
+        self.__ready = ready
+        self.__guard = guard if guard != None else PortGuard()
+        self.__events = events if events != None else diagnostics.EventRing()
         
         self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.__addr = (local_ip, local_port)
@@ -157,6 +266,12 @@ class WriterThrd (threading.Thread):
     def run(self):
         """ Listen for events """
 
+        # Hold off until the rig is ready
+        # Client data waits in the socket buffer meanwhile
+        while self.__ready != None and not self.__ready.wait(1):
+            if self.__terminate:
+                break
+        
         # Processing loop
         while not self.__terminate:
             self.__process()
@@ -176,17 +291,20 @@ class WriterThrd (threading.Thread):
             # No response is not an error
             return
         except socket.error as err:
-            print("Socket error: {0}".format(err))
+            self.__events.record(diagnostics.ERROR, 'writer', "Socket error: {0}".format(err))
             # Probably not connected
             return
 
         # Write data to serial port
         try:
-            self.__ser_port.write(data) 
+            with self.__guard.writing():
+                self.__ser_port.write(data) 
         except serial.SerialTimeoutException:
             # I guess we could get a timeout
-            print("Timeout writing to serial port!")
-            pass
+            self.__events.record(diagnostics.TIMEOUT, 'writer', "Timeout writing to serial port!")
+            if self.__stats != None: self.__stats.incr('writer_errors')
+            return
+        if self.__stats != None: self.__stats.incr('to_serial', len(data))
         
 #=====================================================
 # Main server class
@@ -194,16 +312,31 @@ class WriterThrd (threading.Thread):
 class SerialClient: 
     #-------------------------------------------------
     # Initialisation
-    def __init__(self, port, power) :
+    def __init__(self, port, power, stats=None, bind='', serial_p=None, model='ft817', options=None, macros=None) :
         """
         Constructor
         
         Arguments
-            
+            port        --  control port
+            power       --  True to attempt power control
+            stats       --  optional RigStats when run by the supervisor
+            bind        --  bind address, ''/'*' for any, 'auto' to detect
+            serial_p    --  optional serial parameters to open at startup
+            model       --  rig model, selects the power driver
+            options     --  optional model specific options
+            macros      --  optional dict of stored macros, name: steps
         """
 
         self.__control_port = port
         self.__power = power
+        self.__stats = stats
+        self.__bind = bind
+        self.__serial_p = serial_p
+        self.__model = model
+        self.__options = options if options != None else {}
+        self.__macros = dict(macros) if macros != None else {}
+        self.__events = diagnostics.EventRing()
+        self.__profiler = None
         
     #-------------------------------------------------
     # Main
@@ -215,83 +348,394 @@ class SerialClient:
             
         """
         
-        # Bind address is our ip, control port is provided in args
+        self.__t0 = monotonic()
+        # Events are printed in the background
+        drain = diagnostics.EventDrain(self.__events)
+        drain.start()
+        self.__set_state(rig_stats.STATE_STARTING)
+        self.__ser = None
+        self.__ser_p = None
+        self.__opened = threading.Event()
+        self.__ready = threading.Event()
+        self.__client_addr = None
+        self.__t_open = self.__t_ready = 0.0
+        self.__t_response = None
+        self.__notified = False
+        self.__notify_lock = threading.Lock()
+        self.__guard = PortGuard()
+        self.__scan = None
+        # Power control module once power on has succeeded
+        self.__pc = None
+        
+        # Bind address is given or any, control port is provided in args
         # Client address we get from the first receive.
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.__localip = self.__get_local_ip()
-        if len(self.__localip) == 0:
-            return 0
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__localip = net_addr.resolve_bind(self.__bind)
         addr = (self.__localip, self.__control_port)
-        sock.bind(addr)
-        sock.settimeout(1)
+        self.__sock.bind(addr)
+        self.__sock.settimeout(1)
+        sock = self.__sock
+        
+        # If we know the serial parameters open the port and wake the
+        # rig while we wait for the client
+        prepare_thread = None
+        if self.__serial_p != None:
+            prepare_thread = threading.Thread(target=self.__prepare, args=(self.__serial_p,))
+            prepare_thread.start()
         
         # Wait for connect data on control port
         print ("Serial Server waiting for connect...")
+        self.__set_state(rig_stats.STATE_WAITING)
         while True:
             try:
-                data, client_addr = sock.recvfrom(512)
-                break
+                data, client_addr = sock.recvfrom(CONTROL_BUFFER)
             except socket.timeout:
+                self.__beat()
                 continue
             except KeyboardInterrupt:
                 print("Terminated by user...")
+                if prepare_thread != None:
+                    prepare_thread.join()
+                if self.__ser != None:
+                    self.__ser.close()
                 return 0
-        data = pickle.loads(data)
+            data = self.__decode(data)
+            if data != None:
+                break
         
-        # Open local serial port
-        if data["rqst"] == "connect":
-            if not self.__do_connect(data["data"]["serial"]):
+        # Open local serial port unless already opening with the same parameters
+        if data.get("rqst") == "connect":
+            p = data["data"]["serial"]
+            if prepare_thread != None and self.__serial_p != p:
+                print("Serial Server - client serial parameters differ, reopening...")
+                self.__join(prepare_thread)
+                prepare_thread = None
+                if self.__ser != None:
+                    self.__ser.close()
+                    self.__ser = None
+            if prepare_thread == None:
+                self.__opened.clear()
+                self.__ready.clear()
+                prepare_thread = threading.Thread(target=self.__prepare, args=(p,))
+                prepare_thread.start()
+            # Wake may still be in progress, the threads wait for ready
+            self.__wait(self.__opened)
+            if self.__ser == None:
                 print("Serial Server - Failed to connect to serial port!")
                 return 0
         else:
-            print("Expected connect, got ", data["rqst"])
+            print("Expected connect, got ", data.get("rqst"))
+            if prepare_thread != None:
+                prepare_thread.join()
+            if self.__ser != None:
+                self.__ser.close()
             return 0
-        
-        # Do we need to attempt a power-on
-        if self.__power:
-            # Yes
-            try:
-                import power_control as pc
-                pc.power_on(self.__ser) 
-            except Exception as e:
-                print("Sorry, power control was requested but failed to invoke! [%s]" % (str(e)))
-                self.__power = False
+        self.__client_addr = client_addr
+        if self.__t_response != None:
+            # Rig answered before the client connected
+            self.__notify_ready()
         
         # Start the threads
-        reader_thread = ReaderThrd(client_addr[0], data["data"]["net"][1], self.__ser)
+        reader_thread = ReaderThrd(client_addr[0], data["data"]["net"][1], self.__ser, self.__stats, self.__on_first_response, self.__ready, self.__guard, self.__events)
         reader_thread.start()
-        writer_thread = WriterThrd(self.__localip, data["data"]["net"][0], self.__ser)
+        writer_thread = WriterThrd(self.__localip, data["data"]["net"][0], self.__ser, self.__stats, self.__ready, self.__guard, self.__events)
         writer_thread.start()
         
         print ("Serial Server running...")
-        # Wait for disconnect data
-        while True:
-            try:
-                data, addr = sock.recvfrom(512)
-                break
-            except socket.timeout:
-                continue
-            except KeyboardInterrupt:
-                print("Terminated by user...")
-                return 0
-        data = pickle.loads(data)    
-        # Close local port
-        if data["rqst"] == "disconnect":
+        self.__set_state(rig_stats.STATE_RUNNING)
+        # Serve control requests until disconnect
+        # The threads are not daemons so always stop them on the way out
+        try:
+            while True:
+                # Beat on every pass, a steady stream of requests must not
+                # look like a hang
+                self.__beat()
+                try:
+                    data, addr = sock.recvfrom(CONTROL_BUFFER)
+                except socket.timeout:
+                    continue
+                except KeyboardInterrupt:
+                    print("Terminated by user...")
+                    return 0
+                data = self.__decode(data)
+                if data == None:
+                    continue
+                if data.get("rqst") == "disconnect":
+                    break
+                self.__control(data, addr)
+            
             # Power down if required
-            if self.__power:
-                pc.power_off(self.__ser)
+            self.__stop_scan()
+            self.__join(prepare_thread)
+            if self.__pc != None:
+                self.__pc.power_off(self.__ser, self.__model, **self.__options)
+        finally:
+            # Close local port
+            self.__stop_scan()
+            self.__join(prepare_thread)
             self.__ser.close()
+            
+            # Close threads    
+            reader_thread.terminate()
+            reader_thread.join()
+            writer_thread.terminate()
+            writer_thread.join()
+
+            if self.__profiler != None:
+                self.__profiler.terminate()
+            print("Serial Server exiting...")
+            self.__set_state(rig_stats.STATE_STOPPED)
+            drain.terminate()
+            drain.join()
+        return 0
+
+    #-------------------------------------------------
+    # Unpickle a control request, None if it is not a request dict
+    def __decode(self, data):
+        try:
+            data = pickle.loads(data)
+        except Exception as e:
+            print("Serial Server - bad control request! [%s]" % str(e))
+            return None
+        if not isinstance(data, dict):
+            print("Serial Server - bad control request! [not a dict]")
+            return None
+        return data
+    
+    #-------------------------------------------------
+    # Run a control request and reply to the sender
+    # Handlers take the request data, seq and sender address
+    def __control(self, data, addr):
+        handlers = {
+            "batch": self.__do_batch,
+            "macro": self.__do_macro,
+            "store": self.__do_store,
+            "scan": self.__do_scan,
+            "scanstop": self.__do_scan_stop,
+            "events": self.__do_events,
+            "profile": self.__do_profile,
+        }
+        rqst = data.get("rqst")
+        reply = {"resp": rqst, "seq": data.get("seq")}
+        if rqst not in handlers:
+            reply["error"] = "Unknown request '%s'" % str(rqst)
         else:
-            print("Expected disconnect, got ", data["rqst"])
+            try:
+                reply["data"] = handlers[rqst](data.get("data"), data.get("seq"), addr)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                reply["error"] = "Bad %s request [%s]" % (rqst, str(e))
+            except serial.SerialException as e:
+                reply["error"] = "Serial port error in %s request [%s]" % (rqst, str(e))
+        packet = pickle.dumps(reply)
+        if len(packet) > MAX_DATAGRAM:
+            # Batch responses can be any size, the client can split the batch
+            del reply["data"]
+            reply["error"] = "Reply of %d bytes exceeds %d, send fewer steps" % (len(packet), MAX_DATAGRAM)
+            packet = pickle.dumps(reply)
+        if "error" in reply:
+            self.__events.record(diagnostics.ERROR, 'control', reply["error"])
+        try:
+            self.__sock.sendto(packet, addr)
+        except socket.error as err:
+            self.__events.record(diagnostics.ERROR, 'control', "Error sending control reply: {0}".format(err))
+    
+    #-------------------------------------------------
+    # Run CAT frames back to back, results in one reply
+    def __do_batch(self, d, seq, addr):
+        return self.__run_steps(cat_io.check_steps(d["steps"]), d.get("stoponerror", False))
+    
+    #-------------------------------------------------
+    # Run a stored macro
+    def __do_macro(self, d, seq, addr):
+        if d["id"] not in self.__macros:
+            raise ValueError("No macro '%s'" % str(d["id"]))
+        return self.__run_steps(self.__macros[d["id"]], d.get("stoponerror", False))
+    
+    #-------------------------------------------------
+    # Store a macro for this session
+    def __do_store(self, d, seq, addr):
+        steps = cat_io.check_steps(d["steps"])
+        self.__macros[d["id"]] = steps
+        return {"id": d["id"], "steps": len(steps)}
+    
+    #-------------------------------------------------
+    # Start a scan, records are streamed to the requester as
+    # scandata replies with the seq of the scan request
+    def __do_scan(self, d, seq, addr):
+        if self.__scan != None and self.__scan.is_alive():
+            raise ValueError("Scan already running")
+        if not self.__wait(self.__ready, 10):
+            raise ValueError("Rig not ready")
+        driver = scan_engine.get_driver(self.__model, **self.__options)
         
-        # Close threads    
-        reader_thread.terminate()
-        reader_thread.join()
-        writer_thread.terminate()
-        writer_thread.join()
+        def send(records, done, steps, error):
+            data = {"records": records, "done": done, "steps": steps}
+            if error != None:
+                data["error"] = error
+            try:
+                self.__sock.sendto(pickle.dumps({"resp": "scandata", "seq": seq, "data": data}), addr)
+            except socket.error as err:
+                self.__events.record(diagnostics.ERROR, 'scan', "Error sending scan records: {0}".format(err))
+                
+        self.__scan = scan_engine.ScanThrd(self.__ser, self.__guard, driver, d, send, self.__events)
+        self.__scan.start()
+        return {"started": True}
+    
+    #-------------------------------------------------
+    # Stop the scan, takes effect within one step
+    def __do_scan_stop(self, d, seq, addr):
+        return {"stopped": self.__stop_scan()}
+    
+    def __stop_scan(self):
+        if self.__scan == None or not self.__scan.is_alive():
+            return False
+        self.__scan.terminate()
+        self.__scan.join()
+        return True
+    
+    #-------------------------------------------------
+    # Dump the event ring
+    # Events from the given seq oldest first, up to count that fit one
+    # datagram. next is the seq of the first event not returned so the
+    # client can page through with since
+    def __do_events(self, d, seq, addr):
+        d = d if d != None else {}
+        if not isinstance(d, dict):
+            raise ValueError("Expected a dict")
+        since = d.get("since", 0)
+        count = d.get("count")
+        count = count if count != None else 100
+        if not isinstance(since, int) or not isinstance(count, int) or since < 0 or count < 0:
+            raise ValueError("since and count must be integers >= 0")
+        events, next_seq, lost = self.__events.since(since)
+        if count < len(events):
+            next_seq = events[count][0]
+            events = events[:count]
+        while len(events) > 0 and len(pickle.dumps(events)) > MAX_DATAGRAM:
+            next_seq = events.pop()[0]
+        return {"events": events, "next": next_seq, "lost": lost}
+    
+    #-------------------------------------------------
+    # Start, stop or report on the sampling profiler
+    def __do_profile(self, d, seq, addr):
+        action = d["action"]
+        if action == "start":
+            if self.__profiler != None and self.__profiler.is_alive():
+                raise ValueError("Profiler already running")
+            self.__profiler = diagnostics.SamplingProfiler(float(d["seconds"]), float(d.get("interval", 0.005)))
+            self.__profiler.start()
+            self.__events.record(diagnostics.STATE, 'profile', "Profiling for %ss" % str(d["seconds"]))
+            return {"started": True}
+        if self.__profiler == None:
+            raise ValueError("Profiler has not been run")
+        if action == "stop":
+            self.__profiler.terminate()
+            self.__profiler.join()
+        elif action != "report":
+            raise ValueError("Unknown profile action '%s'" % str(action))
+        return self.__profiler.report(int(d.get("top", 20)))
+    
+    #-------------------------------------------------
+    # Run steps with the port to ourselves
+    # The scan holds the port until it ends so refuse rather than
+    # block the control loop, scanstop must still get through
+    def __run_steps(self, steps, stop_on_error):
+        if self.__scan != None and self.__scan.is_alive():
+            raise ValueError("Scan running")
+        if not self.__wait(self.__ready, 10):
+            raise ValueError("Rig not ready")
+        t = monotonic()
+        with self.__guard.exclusive():
+            results = cat_io.run_batch(self.__ser, steps, stop_on_error, self.__beat)
+        # An answer from the rig is as good as a probe response
+        if len([r for r in results if r['ok'] and len(r['data']) > 0]) > 0:
+            self.__on_first_response()
+        return {"results": results, "ms": (monotonic() - t)*1000}
 
-        print("Serial Server exiting...")
-        return 0
+    #-------------------------------------------------
+    # Report to the supervisor when we have one
+    def __set_state(self, state):
+        self.__events.record(diagnostics.STATE, 'server', rig_stats.STATE_NAMES[state])
+        if self.__stats != None:
+            self.__stats.set('state', state)
+            self.__stats.beat()
+            
+    def __beat(self):
+        if self.__stats != None:
+            self.__stats.beat()
+    
+    #-------------------------------------------------
+    # Blocking waits on the control thread beat every second
+    # so the supervisor does not take a slow rig for a hang
+    def __wait(self, event, timeout=None):
+        end = monotonic() + timeout if timeout != None else None
+        while not event.wait(1):
+            self.__beat()
+            if end != None and monotonic() >= end:
+                return False
+        return True
+    
+    def __join(self, thread):
+        while thread.is_alive():
+            thread.join(1)
+            self.__beat()
+
+    #-------------------------------------------------
+    # Open the serial port and wake the rig
+    # Runs concurrently with the connect handshake when the
+    # serial parameters are known at startup
+    def __prepare(self, p):
+        self.__do_connect(p)
+        self.__opened.set()
+        if self.__ser == None:
+            return
+        self.__t_open = monotonic() - self.__t0
+        
+        # Do we need to attempt a power-on
+        wake = None
+        if self.__power:
+            # Yes
+            try:
+                import power_control as pc
+                wake = pc.power_on(self.__ser, self.__model, **self.__options)
+                self.__pc = pc
+            except Exception as e:
+                print("Sorry, power control was requested but failed to invoke! [%s]" % (str(e)))
+        self.__t_ready = monotonic() - self.__t0
+        # Forward data even if the rig never answered the probe,
+        # the client may know better
+        self.__ready.set()
+        if wake != None or not self.__power:
+            # The probe got a response, or there is no probe and
+            # nothing more to wait for. A failed probe waits for
+            # the rig to answer the client or a batch
+            self.__t_response = self.__t_ready
+            self.__notify_ready()
+    
+    #-------------------------------------------------
+    # Called on the first data from the rig
+    def __on_first_response(self):
+        if self.__t_response == None:
+            self.__t_response = monotonic() - self.__t0
+        self.__notify_ready()
+    
+    #-------------------------------------------------
+    # Report the first confirmed response, once, when the client is known
+    def __notify_ready(self):
+        with self.__notify_lock:
+            if self.__notified or self.__client_addr == None:
+                return
+            self.__notified = True
+        t = self.__t_response
+        print("Serial Server - rig responding after %.0fms (port open %.0fms, rig ready %.0fms)" % (
+            t*1000, self.__t_open*1000, self.__t_ready*1000))
+        if self.__stats != None:
+            self.__stats.set('startup_ms', t*1000)
+        # Tell the client the rig is responding
+        try:
+            self.__sock.sendto(pickle.dumps({"rqst": "ready", "data": {"startup": t, "open": self.__t_open, "ready": self.__t_ready}}), self.__client_addr)
+        except socket.error as err:
+            self.__events.record(diagnostics.ERROR, 'control', "Error sending ready notification: {0}".format(err))
 
     #-------------------------------------------------
     # Connect to serial port        
@@ -309,26 +753,229 @@ class SerialClient:
                                         write_timeout=p["writetimeout"])
         except serial.SerialException:
             print("Failed to open device! ", p["port"])
+            self.__ser = None
             return False
         return True    
+            
+        
+#=====================================================
+# Rig worker process
+#=====================================================
+
+#-------------------------------------------------
+# Entry point for one rig, runs in its own process
+def rig_worker(rig, stats_name, slots, slot):
+    
+    # Pin to a core if asked
+    if rig['core'] != None:
+        if hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(0, {rig['core']})
+            except OSError as e:
+                print("Rig %s - failed to pin to core %d! [%s]" % (rig['name'], rig['core'], str(e)))
+        else:
+            print("Rig %s - core pinning is not supported on %s!" % (rig['name'], platform.system()))
+    
+    block = rig_stats.StatsBlock(slots, stats_name)
+    stats = block.slot(slot)
+    stats.set('pid', os.getpid())
+    try:
+        code = SerialClient(rig['controlport'], rig['power'], stats, rig['bind'], rig['serial'], rig['model'], rig['options'], rig['macros']).main()
+    finally:
+        stats.set('state', rig_stats.STATE_STOPPED)
+        stats.beat()
+        stats = None
+        block.close()
+    sys.exit(code)
+    
+#=====================================================
+# Supervisor, one worker process per rig
+#=====================================================
+class Supervisor:
     
     #-------------------------------------------------
-    # Get my local ip address   
-    def __get_local_ip(self):
+    # Initialisation
+    def __init__(self, conf) :
+        """
+        Constructor
         
-        if platform.system() == 'Windows':
-            return socket.gethostbyname(socket.gethostname())
-        elif platform.system() == 'Linux':
-            ip_address = '';
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8",80))
-            ip_address = s.getsockname()[0]
-            s.close()
-            return ip_address
-        else:
-            print ("Sorry, platform is %s which is not supported!" % platform.system())
-            return ''
-            
+        Arguments
+            conf    --  server configuration file
+        """
+        
+        self.__conf = conf
+        
+    #-------------------------------------------------
+    # Main
+    def main(self) :
+        """
+        Start the workers and restart any that exit or hang
+        until terminated by the user.
+        """
+        
+        conf = read_server_conf(self.__conf)
+        if conf == None:
+            return 0
+        settings, self.__rigs = conf
+        self.__interval = settings['statsinterval']
+        self.__hang = settings['hangtimeout']
+        
+        # One stats slot per rig
+        self.__block = rig_stats.StatsBlock(len(self.__rigs))
+        self.__workers = [None]*len(self.__rigs)
+        # Earliest restart time and current backoff for each rig
+        self.__next_start = [0.0]*len(self.__rigs)
+        self.__backoff = [1.0]*len(self.__rigs)
+        self.__started = [0.0]*len(self.__rigs)
+        
+        print ("Serial Server supervisor running %d rig(s)..." % len(self.__rigs))
+        last_report = time()
+        try:
+            while True:
+                for slot in range(len(self.__rigs)):
+                    self.__check(slot)
+                if self.__interval > 0 and time() - last_report >= self.__interval:
+                    self.__report()
+                    last_report = time()
+                sleep(1)
+        except KeyboardInterrupt:
+            print("Terminated by user...")
+        
+        # Stop everything
+        for slot in range(len(self.__rigs)):
+            self.__stop(slot)
+        self.__block.close()
+        print("Serial Server supervisor exiting...")
+        return 0
+    
+    #-------------------------------------------------
+    # Check one worker, start or restart as required
+    def __check(self, slot):
+        rig = self.__rigs[slot]
+        stats = self.__block.slot(slot)
+        p = self.__workers[slot]
+        if p != None and p.is_alive():
+            # Still running, restart if hung
+            # A worker that has stopped but not exited within the
+            # hang time is stuck as well
+            if time() - stats.get('heartbeat') > self.__hang:
+                print("Rig %s - worker %d not responding, restarting..." % (rig['name'], p.pid))
+                p.terminate()
+            return
+        
+        if p != None:
+            # Worker has gone
+            p.join()
+            self.__workers[slot] = None
+            if p.exitcode != 0:
+                print("Rig %s - worker %d exited with code %s!" % (rig['name'], p.pid, str(p.exitcode)))
+            # Back off if it is failing quickly
+            if time() - self.__started[slot] < 5.0:
+                self.__backoff[slot] = min(self.__backoff[slot]*2, 30.0)
+            else:
+                self.__backoff[slot] = 1.0
+            self.__next_start[slot] = time() + self.__backoff[slot]
+            stats.incr('restarts')
+        
+        if time() < self.__next_start[slot]:
+            return
+        stats.set('state', rig_stats.STATE_STARTING)
+        stats.beat()
+        p = multiprocessing.Process(target=rig_worker, name='rig-%s' % rig['name'], args=(rig, self.__block.name(), len(self.__rigs), slot))
+        p.start()
+        self.__workers[slot] = p
+        self.__started[slot] = time()
+    
+    #-------------------------------------------------
+    # Stop one worker
+    def __stop(self, slot):
+        p = self.__workers[slot]
+        if p == None:
+            return
+        p.join(5)
+        if p.is_alive():
+            p.terminate()
+            p.join()
+        self.__workers[slot] = None
+    
+    #-------------------------------------------------
+    # Print current stats for all rigs
+    def __report(self):
+        now = time()
+        for slot, rig in enumerate(self.__rigs):
+            st = self.__block.slot(slot).snapshot()
+            print("Rig %-10s pid %-7d %-8s to-net %-10d to-serial %-10d errors %-5d restarts %-3d startup %.0fms heartbeat %.1fs" % (
+                rig['name'], st['pid'], rig_stats.STATE_NAMES.get(st['state'], '?'),
+                st['to_net'], st['to_serial'], st['reader_errors'] + st['writer_errors'],
+                st['restarts'], st['startup_ms'], now - st['heartbeat']))
+    
+#-------------------------------------------------
+# Read the supervisor settings and rig sections
+def read_server_conf(path):
+    
+    c = configparser.ConfigParser()
+    if len(c.read(path)) == 0:
+        print ("Failed to read '%s', please create and try again!" % path)
+        return None
+    settings = {'statsinterval': 0, 'hangtimeout': 20.0}
+    rigs = []
+    macros = {}
+    try:
+        if 'supervisor' in c:
+            settings['statsinterval'] = int(c['supervisor'].get('statsinterval', '0'))
+            settings['hangtimeout'] = float(c['supervisor'].get('hangtimeout', '20'))
+        # Stored macros, available to all rigs
+        for section in c.sections():
+            if section.startswith('macro:'):
+                macros[section[6:]] = cat_io.parse_steps(c[section]['steps'])
+        for section in c.sections():
+            if not section.startswith('rig:'):
+                continue
+            s = c[section]
+            rig = {}
+            rig['name'] = section[4:]
+            rig['controlport'] = int(s['controlport'])
+            rig['power'] = s.getboolean('power', False)
+            rig['bind'] = s.get('bind', '')
+            core = s.get('core', '')
+            rig['core'] = int(core) if len(core) > 0 else None
+            # Rig model selects the power driver
+            rig['model'] = s.get('model', 'ft817')
+            rig['options'] = {}
+            if 'civaddr' in s:
+                rig['options']['civaddr'] = int(s['civaddr'], 0)
+            if 'waketimeout' in s:
+                rig['options']['timeout'] = float(s['waketimeout'])
+            rig['macros'] = macros
+            # Serial parameters are optional, when present the port
+            # is opened at startup rather than on client connect
+            rig['serial'] = None
+            if 'port' in s:
+                rig['serial'] = {
+                    'port': s['port'],
+                    'baud': int(s['baudrate']),
+                    'databits': int(s['databits']),
+                    'parity': s['parity'],
+                    'stopbits': int(s['stopbits']),
+                    'readtimeout': float(s['readtimeout']),
+                    'writetimeout': float(s['writetimeout']),
+                    'xonxoff': int(s['xonxoff']),
+                    'rtscts': int(s['rtscts']),
+                }
+            rigs.append(rig)
+    except KeyError as k:
+        print ("Missing: %s from configuration!" % k)
+        return None
+    except ValueError as e:
+        print ("Invalid value in configuration! [%s]" % str(e))
+        return None
+    if len(rigs) == 0:
+        print ("No [rig:name] sections in configuration!")
+        return None
+    for rig in rigs:
+        if rig['options'].get('timeout', 10.0) >= settings['hangtimeout']:
+            print ("Rig %s - waketimeout should be less than hangtimeout!" % rig['name'])
+    return settings, rigs
         
 #=====================================================
 # Entry point
@@ -341,18 +988,61 @@ def main():
     if len(sys.argv) < 2:
         msg = """
         serial_server.py control-port (e.g. 10000 - reqd)
-        \t power-control (e.g. true/false - optional)
+        \t power-control (e.g. true/false or rig model ft817/icom - optional)
+        \t bind-address (e.g. 192.168.1.110, * for any or auto - optional, default any)
+        or
+        serial_server.py --supervisor conf_filename
+        or
+        serial_server.py --rig conf_filename rig_name
         """
         print (msg)
         return
     
+    if sys.argv[1] == '--supervisor':
+        if len(sys.argv) != 3:
+            print("Please supply a configuration filename!")
+            return
+        try:
+            app = Supervisor(sys.argv[2])
+            sys.exit(app.main())
+        except Exception as e:
+            print ('Exception from main SerialServer code','Exception [%s][%s]' % (str(e), traceback.format_exc()))
+        return
+    
+    if sys.argv[1] == '--rig':
+        # Run a single configured rig in this process
+        if len(sys.argv) != 4:
+            print("Please supply a configuration filename and rig name!")
+            return
+        conf = read_server_conf(sys.argv[2])
+        if conf == None:
+            return
+        rigs = [r for r in conf[1] if r['name'] == sys.argv[3]]
+        if len(rigs) == 0:
+            print("No rig '%s' in configuration!" % sys.argv[3])
+            return
+        rig = rigs[0]
+        try:
+            app = SerialClient(rig['controlport'], rig['power'], None, rig['bind'], rig['serial'], rig['model'], rig['options'], rig['macros'])
+            sys.exit(app.main())
+        except Exception as e:
+            print ('Exception from main SerialServer code','Exception [%s][%s]' % (str(e), traceback.format_exc()))
+        return
+    
     power_control = False
-    if len(sys.argv) == 3:
+    model = 'ft817'
+    if len(sys.argv) >= 3:
         if sys.argv[2] == 'true':
             power_control = True
+        elif sys.argv[2] != 'false':
+            power_control = True
+            model = sys.argv[2]
+    bind = ''
+    if len(sys.argv) == 4:
+        bind = sys.argv[3]
         
     try:
-        app = SerialClient(int(sys.argv[1]), power_control)
+        app = SerialClient(int(sys.argv[1]), power_control, None, bind, None, model)
         sys.exit(app.main())
         
     except Exception as e:
@@ -0,0 +1,60 @@
+#
+# conftest.py
+#
+# Shared test setup, the modules live flat in src
+#
+
+import os
+import sys
+import threading
+from time import sleep
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+#=====================================================
+# Serial port double
+#=====================================================
+class FakePort:
+    """
+    Stands in for an open serial.Serial. Each write is passed to
+    answer(frame) which returns the bytes the rig sends back, or
+    raises to simulate a port failure. Reads behave like a port with
+    a read timeout.
+    """
+
+    def __init__(self, answer=None, timeout=0.01):
+        self.answer = answer if answer != None else (lambda frame: b'')
+        self.timeout = timeout
+        self.written = []
+        self.resets = 0
+        self.__inq = bytearray()
+        self.__lock = threading.Lock()
+
+    def write(self, data):
+        data = bytes(data)
+        self.written.append(data)
+        resp = self.answer(data)
+        with self.__lock:
+            self.__inq += resp
+        return len(data)
+
+    def read(self, n=1):
+        with self.__lock:
+            if len(self.__inq) > 0:
+                data = bytes(self.__inq[:n])
+                del self.__inq[:n]
+                return data
+        sleep(self.timeout)
+        return b''
+
+    def reset_input_buffer(self):
+        self.resets += 1
+        with self.__lock:
+            self.__inq.clear()
+
+@pytest.fixture
+def fake_port():
+    """ Factory for FakePort instances """
+    return FakePort
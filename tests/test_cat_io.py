@@ -0,0 +1,132 @@
+#
+# test_cat_io.py
+#
+
+import pytest
+
+import cat_io
+
+FREQ_RESP = bytes([0x01, 0x42, 0x34, 0x56, 0x01])
+
+def ft817(frame):
+    if frame == bytes([0, 0, 0, 0, 0x03]):
+        return FREQ_RESP
+    if frame == bytes([0, 0, 0, 0, 0xE7]):
+        return bytes([0x09])
+    return b''
+
+#-------------------------------------------------
+# parse_steps
+def test_parse_steps_reads_frames_and_options():
+    steps = cat_io.parse_steps("""
+        # status
+        00 00 00 00 03 length=5
+        FE FE 94 E0 03 FD term=FD echo=1 timeout=0.2   # icom
+        0000000001 length=0
+        """)
+    assert steps == [
+        {'frame': bytes([0, 0, 0, 0, 0x03]), 'length': 5},
+        {'frame': bytes([0xFE, 0xFE, 0x94, 0xE0, 0x03, 0xFD]), 'term': 0xFD, 'echo': True, 'timeout': 0.2},
+        {'frame': bytes([0, 0, 0, 0, 0x01]), 'length': 0},
+    ]
+
+def test_parse_steps_echo_off():
+    assert cat_io.parse_steps("00 echo=0")[0]['echo'] == False
+
+def test_parse_steps_rejects_unknown_option():
+    with pytest.raises(ValueError):
+        cat_io.parse_steps("00 00 00 00 03 size=5")
+
+def test_parse_steps_rejects_bad_hex():
+    with pytest.raises(ValueError):
+        cat_io.parse_steps("00 GG")
+
+#-------------------------------------------------
+# check_steps
+def test_check_steps_normalises_frames():
+    steps = cat_io.check_steps([{'frame': [0, 0, 0, 0, 3], 'length': 5}, {'frame': bytearray(b'\x01')}])
+    assert steps[0] == {'frame': b'\x00\x00\x00\x00\x03', 'length': 5}
+    assert isinstance(steps[1]['frame'], bytes)
+
+@pytest.mark.parametrize('steps', [
+    None,
+    'steps',
+    [1],
+    [{'length': 5}],
+    [{'frame': 5}],
+    [{'frame': 'abc'}],
+    [{'frame': [300]}],
+    [{'frame': ['a']}],
+    [{'frame': b'\x00', 'length': -1}],
+    [{'frame': b'\x00', 'term': 'FD'}],
+    [{'frame': b'\x00', 'timeout': 'long'}],
+])
+def test_check_steps_rejects(steps):
+    with pytest.raises(ValueError):
+        cat_io.check_steps(steps)
+
+#-------------------------------------------------
+# BCD
+def test_bcd_round_trip():
+    assert cat_io.to_bcd(1423456, 4) == bytes([0x01, 0x42, 0x34, 0x56])
+    assert cat_io.from_bcd(bytes([0x01, 0x42, 0x34, 0x56])) == 1423456
+    assert cat_io.to_bcd(0, 2) == b'\x00\x00'
+
+def test_bcd_overflow():
+    with pytest.raises(ValueError):
+        cat_io.to_bcd(100000000, 4)
+
+#-------------------------------------------------
+# transact and run_batch
+def test_transact_length_and_no_response(fake_port):
+    port = fake_port(ft817)
+    assert cat_io.transact(port, bytes([0, 0, 0, 0, 0x03]), length=5) == FREQ_RESP
+    assert cat_io.transact(port, bytes([0, 0, 0, 0, 0x01]), length=0) == b''
+    assert port.resets == 2
+
+def test_transact_quiet_line_ends_response(fake_port):
+    port = fake_port(lambda frame: b'abc')
+    assert cat_io.transact(port, b'x') == b'abc'
+
+def test_transact_timeout_returns_short(fake_port):
+    port = fake_port(lambda frame: b'\x01\x02')
+    assert cat_io.transact(port, b'x', length=5, timeout=0.05) == b'\x01\x02'
+
+def test_run_batch_results(fake_port):
+    port = fake_port(ft817)
+    calls = []
+    results = cat_io.run_batch(port, [
+        {'frame': bytes([0, 0, 0, 0, 0x01]), 'length': 0},
+        {'frame': bytes([0, 0, 0, 0, 0x03]), 'length': 5},
+        {'frame': bytes([0, 0, 0, 0, 0xE7]), 'length': 1},
+    ], on_step=lambda: calls.append(1))
+    assert [r['data'] for r in results] == [b'', FREQ_RESP, b'\x09']
+    assert [r['ok'] for r in results] == [True, True, True]
+    assert len(calls) == 3
+    assert port.written == [bytes([0, 0, 0, 0, 1]), bytes([0, 0, 0, 0, 3]), bytes([0, 0, 0, 0, 0xE7])]
+
+def test_run_batch_stop_on_error(fake_port):
+    port = fake_port(ft817)
+    steps = [{'frame': b'\x99', 'length': 5, 'timeout': 0.05}, {'frame': bytes([0, 0, 0, 0, 0x03]), 'length': 5}]
+    assert len(cat_io.run_batch(port, steps)) == 2
+    results = cat_io.run_batch(port, steps, stop_on_error=True)
+    assert len(results) == 1 and results[0]['ok'] == False
+
+def test_run_batch_skips_echo(fake_port):
+    frame = cat_io.civ_frame(0x94, [0x03])
+    reply = bytes([0xFE, 0xFE, 0xE0, 0x94, 0x03, 0x00, 0x50, 0x34, 0x14, 0x00, 0xFD])
+    port = fake_port(lambda f: f + reply)
+    results = cat_io.run_batch(port, [{'frame': frame, 'term': cat_io.CIV_EOM, 'echo': True}])
+    assert results[0]['data'] == reply
+
+#-------------------------------------------------
+# CI-V
+def test_civ_transact_skips_echo_and_returns_body(fake_port):
+    reply = bytes([0xFE, 0xFE, 0xE0, 0x94, 0x15, 0x02, 0x01, 0x20, 0xFD])
+    port = fake_port(lambda f: f + reply)
+    assert cat_io.civ_transact(port, 0x94, [0x15, 0x02]) == bytes([0x15, 0x02, 0x01, 0x20])
+
+def test_civ_transact_ignores_other_rigs(fake_port):
+    other = bytes([0xFE, 0xFE, 0xE0, 0x88, 0x15, 0x02, 0x01, 0x20, 0xFD])
+    port = fake_port(lambda f: f + other)
+    assert cat_io.civ_transact(port, 0x94, [0x15, 0x02], timeout=0.1) == None
@@ -0,0 +1,54 @@
+#
+# test_diagnostics.py
+#
+
+import diagnostics
+
+def fill(ring, n):
+    for i in range(n):
+        ring.record(diagnostics.INFO, 'test', 'event %d' % i)
+
+def test_since_returns_events_oldest_first():
+    ring = diagnostics.EventRing(8)
+    fill(ring, 5)
+    events, next_seq, lost = ring.since(0)
+    assert [e[0] for e in events] == [0, 1, 2, 3, 4]
+    assert [e[4] for e in events] == ['event %d' % i for i in range(5)]
+    assert next_seq == 5 and lost == 0
+
+def test_since_part_way():
+    ring = diagnostics.EventRing(8)
+    fill(ring, 5)
+    events, next_seq, lost = ring.since(3)
+    assert [e[0] for e in events] == [3, 4]
+    assert ring.since(next_seq) == ([], 5, 0)
+
+def test_since_after_wrap_counts_lost():
+    ring = diagnostics.EventRing(8)
+    fill(ring, 20)
+    events, next_seq, lost = ring.since(0)
+    assert [e[0] for e in events] == list(range(12, 20))
+    assert next_seq == 20
+    assert lost == 12
+
+def test_since_after_wrap_from_unread_position():
+    ring = diagnostics.EventRing(8)
+    fill(ring, 10)
+    events, next_seq, lost = ring.since(10)
+    fill(ring, 11)
+    events, next_seq, lost = ring.since(next_seq)
+    assert [e[0] for e in events] == list(range(13, 21))
+    assert lost == 3
+
+def test_since_within_ring_after_wrap_loses_nothing():
+    ring = diagnostics.EventRing(8)
+    fill(ring, 20)
+    events, next_seq, lost = ring.since(15)
+    assert [e[0] for e in events] == [15, 16, 17, 18, 19]
+    assert lost == 0
+
+def test_format_event():
+    ring = diagnostics.EventRing(4)
+    ring.record(diagnostics.ERROR, 'reader', 'bad thing')
+    line = diagnostics.format_event(ring.since(0)[0][0])
+    assert line.endswith('error   reader: bad thing')
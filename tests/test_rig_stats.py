@@ -0,0 +1,66 @@
+#
+# test_rig_stats.py
+#
+
+import struct
+from time import time
+
+import pytest
+
+import rig_stats
+
+@pytest.fixture
+def block():
+    b = rig_stats.StatsBlock(3)
+    yield b
+    b.close()
+
+def test_slot_layout_is_packed_in_field_order():
+    end = 0
+    for name, fmt in rig_stats.FIELDS:
+        offset, field_fmt = rig_stats.OFFSETS[name]
+        assert offset == end
+        end = offset + struct.calcsize(field_fmt)
+    assert end == rig_stats.SLOT_SIZE
+
+def test_new_block_is_zeroed(block):
+    for n in range(3):
+        assert set(block.slot(n).snapshot().values()) == {0}
+
+def test_fields_round_trip_and_slots_are_independent(block):
+    a = block.slot(0)
+    b = block.slot(1)
+    a.set('pid', 1234)
+    a.set('state', rig_stats.STATE_RUNNING)
+    a.set('startup_ms', 12.5)
+    a.incr('to_net', 10)
+    a.incr('to_net')
+    assert a.get('pid') == 1234
+    assert a.get('state') == rig_stats.STATE_RUNNING
+    assert a.get('startup_ms') == 12.5
+    assert a.get('to_net') == 11
+    assert set(b.snapshot().values()) == {0}
+
+def test_beat_sets_heartbeat(block):
+    s = block.slot(2)
+    s.beat()
+    assert abs(time() - s.get('heartbeat')) < 1.0
+
+def test_attached_block_shares_memory(block):
+    other = rig_stats.StatsBlock(3, block.name())
+    try:
+        block.slot(1).set('restarts', 7)
+        assert other.slot(1).get('restarts') == 7
+        other.slot(1).set('writer_errors', 3)
+        assert block.slot(1).get('writer_errors') == 3
+    finally:
+        other.close()
+
+def test_slot_out_of_range(block):
+    with pytest.raises(IndexError):
+        block.slot(3)
+    with pytest.raises(IndexError):
+        block.slot(-1)
+
+def test_snapshot_has_every_field(block):
+    assert list(block.slot(0).snapshot().keys()) == [n for n, _ in rig_stats.FIELDS]
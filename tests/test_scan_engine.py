@@ -0,0 +1,128 @@
+#
+# test_scan_engine.py
+#
+
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
+import pytest
+import serial
+
+import cat_io
+import scan_engine
+import diagnostics
+
+#-------------------------------------------------
+# FT817 that reports a strong signal on 14.0002MHz, squelch open there
+class Rig:
+
+    def __init__(self, fail_after=None):
+        self.freq = None
+        self.frames = 0
+        self.fail_after = fail_after
+
+    def answer(self, frame):
+        self.frames += 1
+        if self.fail_after != None and self.frames > self.fail_after:
+            raise serial.SerialException("port gone")
+        if len(frame) == 5 and frame[4] == 0x01:
+            self.freq = cat_io.from_bcd(frame[:4])*10
+            return b''
+        if frame == bytes([0, 0, 0, 0, 0xE7]):
+            return bytes([0x09]) if self.freq == 14000200 else bytes([0x81])
+        return b''
+
+class Guard:
+    """ Records whether the scan held the port """
+
+    def __init__(self):
+        self.held = False
+
+    @contextmanager
+    def exclusive(self):
+        self.held = True
+        try:
+            yield
+        finally:
+            self.held = False
+
+class Blocks:
+    """ Collects what the scan sends """
+
+    def __init__(self):
+        self.blocks = []
+        self.done = threading.Event()
+
+    def __call__(self, records, done, steps, error):
+        self.blocks.append((records, done, steps, error))
+        if done:
+            self.done.set()
+
+    def records(self):
+        return [r for b in self.blocks for r in scan_engine.unpack_records(b[0])]
+
+def scan(port, params, events=None):
+    blocks = Blocks()
+    t = scan_engine.ScanThrd(port, Guard(), scan_engine.get_driver('ft817'), params, blocks, events)
+    return t, blocks
+
+def test_scan_reports_steps_over_threshold(fake_port):
+    port = fake_port(Rig().answer)
+    t, blocks = scan(port, {'start': 14000000, 'stop': 14000500, 'step': 100, 'threshold': 5})
+    t.start()
+    t.join(5)
+    assert not t.is_alive()
+    assert blocks.records() == [(14000200, 9)]
+    records, done, steps, error = blocks.blocks[-1]
+    assert done and steps == 6 and error == None
+    assert [b[1] for b in blocks.blocks].count(True) == 1
+
+def test_scan_squelch(fake_port):
+    port = fake_port(Rig().answer)
+    t, blocks = scan(port, {'start': 14000000, 'stop': 14000500, 'step': 100, 'squelch': True})
+    t.start()
+    t.join(5)
+    assert blocks.records() == [(14000200, 9)]
+
+def test_scan_stops_within_one_step(fake_port):
+    port = fake_port(Rig().answer)
+    t, blocks = scan(port, {'start': 14000000, 'stop': 15000000, 'step': 100, 'dwell': 5.0})
+    t.start()
+    while port.written == []:
+        pass
+    t0 = monotonic()
+    t.terminate()
+    assert blocks.done.wait(1.0)
+    t.join(1.0)
+    assert monotonic() - t0 < 0.5
+    assert blocks.blocks[-1][1] == True
+
+def test_scan_reports_serial_failure(fake_port):
+    events = diagnostics.EventRing()
+    port = fake_port(Rig(fail_after=6).answer)
+    t, blocks = scan(port, {'start': 14000000, 'stop': 14100000, 'step': 100}, events)
+    t.start()
+    t.join(5)
+    records, done, steps, error = blocks.blocks[-1]
+    assert done and steps == 3
+    assert error == 'port gone'
+    assert events.since(0)[0][-1][2:4] == (diagnostics.ERROR, 'scan')
+
+@pytest.mark.parametrize('params', [
+    {'start': 14000000, 'stop': 13000000, 'step': 100},
+    {'start': 14000000, 'stop': 15000000, 'step': 0},
+    {'start': -1, 'stop': 15000000, 'step': 100},
+    {'start': 0, 'stop': 100000000, 'step': 1},
+])
+def test_scan_rejects_bad_range(fake_port, params):
+    with pytest.raises(ValueError):
+        scan(fake_port(), params)
+
+def test_unpack_records():
+    data = scan_engine.RECORD.pack(14000000, 3) + scan_engine.RECORD.pack(14000100, 255)
+    assert scan_engine.unpack_records(data) == [(14000000, 3), (14000100, 255)]
+
+def test_unknown_model():
+    with pytest.raises(ValueError):
+        scan_engine.get_driver('nosuchrig')
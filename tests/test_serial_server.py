@@ -0,0 +1,75 @@
+#
+# test_serial_server.py
+#
+
+import threading
+from time import sleep, perf_counter
+
+import serial_server
+
+#-------------------------------------------------
+# PortGuard
+def hold_reads(guard, stop, period=0.05):
+    while not stop.is_set():
+        with guard.reading():
+            sleep(period)
+
+def test_writer_does_not_wait_for_reader():
+    guard = serial_server.PortGuard()
+    stop = threading.Event()
+    reader = threading.Thread(target=hold_reads, args=(guard, stop))
+    reader.start()
+    try:
+        sleep(0.01)
+        worst = 0.0
+        for _ in range(20):
+            t = perf_counter()
+            with guard.writing():
+                pass
+            worst = max(worst, perf_counter() - t)
+            sleep(0.005)
+        assert worst < 0.025
+    finally:
+        stop.set()
+        reader.join()
+
+def test_exclusive_holds_off_reader_and_writer():
+    guard = serial_server.PortGuard()
+    order = []
+
+    def use(hold, name):
+        with hold():
+            order.append(name)
+
+    with guard.exclusive():
+        threads = [
+            threading.Thread(target=use, args=(guard.reading, 'read')),
+            threading.Thread(target=use, args=(guard.writing, 'write')),
+        ]
+        for t in threads:
+            t.start()
+        sleep(0.05)
+        order.append('exclusive done')
+    for t in threads:
+        t.join(1.0)
+    assert order[0] == 'exclusive done'
+    assert sorted(order[1:]) == ['read', 'write']
+
+def test_exclusive_waits_for_read_in_flight():
+    guard = serial_server.PortGuard()
+    started = threading.Event()
+    finished = []
+
+    def read():
+        with guard.reading():
+            started.set()
+            sleep(0.05)
+            finished.append(perf_counter())
+
+    t = threading.Thread(target=read)
+    t.start()
+    started.wait()
+    with guard.exclusive():
+        entered = perf_counter()
+    t.join()
+    assert finished[0] <= entered